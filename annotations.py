@@ -0,0 +1,130 @@
+import os
+import sys
+import json
+import argparse
+
+ANNOTATION_FILE = 'ground_truth.jsonl'
+# Size (width, height) of the groundTruth.py canvas the polygons are drawn on
+CANVAS = (800, 600)
+
+class AnnotationStore:
+    """Append-only JSON lines file of the ground truth annotations
+
+    Every line is one annotation: {'filename', 'type', 'coordinates': [[x, y], ...],
+    'canvas': [width, height], 'size': [width, height]}, the coordinates are on the
+    canvas and size is the original image size (None if unknown), so the polygon in
+    image pixels is coordinates * size / canvas. An image annotated again gets a new
+    line, the last one wins.
+    offsets: {filename: byte offset of its last line}, read once when the store is opened
+    """
+    def __init__(self, path=ANNOTATION_FILE):
+        self.path = path
+        self.offsets = {}
+        self.file = None
+        self.newline = False
+        if os.path.exists(path):
+            self.read_index()
+
+    def read_index(self):
+        offset = 0
+        with open(self.path, 'rb') as f:
+            for line in f:
+                try:
+                    self.offsets[json.loads(line)['filename']] = offset
+                except (ValueError, KeyError):
+                    # the last line of a session that crashed while writing it
+                    print(f'Skipped a broken line of {self.path} at byte {offset}', file=sys.stderr)
+                offset += len(line)
+                self.newline = not line.endswith(b'\n')
+
+    def __contains__(self, filename):
+        return filename in self.offsets
+
+    def __len__(self):
+        return len(self.offsets)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def get(self, filename):
+        """The last annotation of filename, None if it was never annotated"""
+        if filename not in self.offsets:
+            return None
+        with open(self.path, 'rb') as f:
+            f.seek(self.offsets[filename])
+            return json.loads(f.readline())
+
+    def items(self):
+        """(filename, annotation) of every annotated image, in annotation order"""
+        with open(self.path, 'rb') as f:
+            for filename, offset in sorted(self.offsets.items(), key=lambda item: item[1]):
+                f.seek(offset)
+                yield filename, json.loads(f.readline())
+
+    def add(self, filename, shape_type, coordinates, size=None, canvas=CANVAS):
+        """Append one annotation, flushed at once so a crash loses at most this line"""
+        if self.file is None:
+            self.file = open(self.path, 'ab')
+            if self.newline:
+                # finish the broken line, the next ones stay readable
+                self.file.write(b'\n')
+        annotation = {
+            'filename': filename,
+            'type': shape_type,
+            'coordinates': [[int(x), int(y)] for x, y in coordinates],
+            'canvas': list(canvas),
+            'size': list(size) if size is not None else None,
+        }
+        self.offsets[filename] = self.file.tell()
+        self.file.write(json.dumps(annotation).encode() + b'\n')
+        self.file.flush()
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+def import_json(json_file, store, sizes=None):
+    """Append the annotations of a ground_truth.json dict written by the old groundTruth.py
+
+    Its coordinates are a '[x, y], [x, y], ...' string. sizes: {filename: (width, height)}
+    of the images, their size is None otherwise. Returns the number of imported images.
+    """
+    with open(json_file) as f:
+        data = json.load(f)
+    for filename, label in data.items():
+        coordinates = label['coordinates']
+        if isinstance(coordinates, str):
+            coordinates = json.loads(f'[{coordinates}]')
+        store.add(filename, label['type'], coordinates, (sizes or {}).get(filename))
+    return len(data)
+
+def image_sizes(input_folder):
+    """{filename: (width, height)} of the images under input_folder, from their headers"""
+    from PIL import Image
+    from common import list_images
+    sizes = {}
+    for path in list_images(input_folder):
+        with Image.open(path) as img:
+            sizes[os.path.basename(path)] = img.size
+    return sizes
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Import a ground_truth.json file into an annotation store')
+    parser.add_argument('json_file', help='ground_truth.json written by the old groundTruth.py')
+    parser.add_argument('--output', default=ANNOTATION_FILE)
+    parser.add_argument('--input', help='folder of the annotated images, to record their size')
+    return parser.parse_args()
+
+def main():
+    args = parse_args()
+    sizes = image_sizes(args.input) if args.input else None
+    with AnnotationStore(args.output) as store:
+        count = import_json(args.json_file, store, sizes)
+        print(f'{count} annotations imported, {len(store)} images in {args.output}', file=sys.stderr)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,183 @@
+import os
+import sys
+import json
+import time
+import platform
+import tempfile
+import argparse
+import subprocess
+import cv2
+import numpy as np
+
+import context
+from common import CLASSIFIERS, list_images
+from output import OutputWriter
+from parallel import classify_record, output_of
+from pipeline import THRESHOLD_MODES
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+def peak_rss_mb():
+    """Peak resident memory of this process in MB, None where it can't be read"""
+    if resource is None:
+        return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on macOS and in kilobytes on Linux
+    return rss / 2**20 if sys.platform == 'darwin' else rss / 2**10
+
+def benchmark(paths, classifier='images', output_folder=None, max_size=None, thresholds=None):
+    """Classify paths one by one and measure the latency and time of every stage
+    
+    output_folder: where the outputs are written, None skips the output write stage
+    max_size: downscale every image to this larger side before thresholding
+    thresholds: 'inline' or 'fused' threshold stage, the one of the classifier by default
+    """
+    latencies = []
+    stages = {}
+    # written synchronously, so the write stage is measured
+    writer = OutputWriter(output_folder, output_of(classifier), workers=0) if output_folder else None
+    for path in paths:
+        timings = {}
+        start = time.perf_counter()
+        image = cv2.imread(path)
+        timings['decode'] = time.perf_counter() - start
+        if image is not None:
+            classify_start = time.perf_counter()
+            ctx = context.ImageContext(image, timings, max_size)
+            record = classify_record(image, os.path.basename(path), classifier, ctx, thresholds)
+            classify_time = time.perf_counter() - classify_start
+            # what is left is the selection and Result / detect_shape work
+            timings['shape'] = timings.get('shape', 0) + classify_time - sum(
+                seconds for stage, seconds in timings.items() if stage != 'decode')
+            if writer is not None:
+                write_start = time.perf_counter()
+                writer.write(image, path, record)
+                timings['write'] = time.perf_counter() - write_start
+        latencies.append(time.perf_counter() - start)
+        for stage, seconds in timings.items():
+            context.add_timing(stages, stage, seconds)
+
+    total = sum(latencies)
+    latencies_ms = np.array(latencies) * 1000
+    return {
+        'classifier': classifier,
+        'thresholds': thresholds,
+        'images': len(paths),
+        'total_s': total,
+        'images_per_s': len(paths) / total if total else 0,
+        'latency_ms': {
+            'mean': float(latencies_ms.mean()),
+            'p50': float(np.percentile(latencies_ms, 50)),
+            'p95': float(np.percentile(latencies_ms, 95)),
+            'p99': float(np.percentile(latencies_ms, 99)),
+        },
+        # mean milliseconds per image spent in every stage
+        'stages_ms': {stage: seconds * 1000 / len(paths) for stage, seconds in stages.items()},
+        'peak_rss_mb': peak_rss_mb(),
+    }
+
+# Modules imported by a worker process or a CLI call, gui is the matplotlib panels
+STARTUP_MODULES = ('common', 'pipeline', 'parallel', 'main', 'gui')
+# Run in a fresh interpreter: seconds to import a module, peak memory and GUI modules loaded
+STARTUP_PROBE = """
+import sys, time, json
+start = time.perf_counter()
+import {module}
+seconds = time.perf_counter() - start
+try:
+    import resource
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    rss = rss / 2**20 if sys.platform == 'darwin' else rss / 2**10
+except ImportError:
+    rss = None
+print(json.dumps({{'seconds': seconds, 'peak_rss_mb': rss,
+                  'gui': sorted(m for m in ('matplotlib', 'tkinter') if m in sys.modules)}}))
+"""
+
+def startup(modules=STARTUP_MODULES, repeats=5):
+    """Import time and peak memory of every module in fresh interpreters, the best of repeats"""
+    runs = []
+    for module in modules:
+        probes = []
+        for _ in range(repeats):
+            out = subprocess.run([sys.executable, '-c', STARTUP_PROBE.format(module=module)],
+                                 capture_output=True, text=True, check=True,
+                                 cwd=os.path.dirname(os.path.abspath(__file__))).stdout
+            probes.append(json.loads(out))
+        best = min(probes, key=lambda probe: probe['seconds'])
+        runs.append({
+            'module': module,
+            'import_ms': best['seconds'] * 1000,
+            'peak_rss_mb': best['peak_rss_mb'],
+            'gui_modules': best['gui'],
+        })
+    return runs
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Benchmark of the shape detection pipeline')
+    parser.add_argument('--input', nargs='+', default=['traffic_Data/TEST'],
+                        help='folders of the images, class folders included')
+    parser.add_argument('--classifier', nargs='+', default=['images'],
+                        choices=CLASSIFIERS)
+    parser.add_argument('--stride', type=int, default=1, help='benchmark every n-th image only')
+    parser.add_argument('--limit', type=int, help='maximum number of images')
+    parser.add_argument('--max-size', type=int, help='downscale the images to this larger side')
+    parser.add_argument('--thresholds', choices=THRESHOLD_MODES,
+                        help='threshold stage of the classifiers, the one of their pipeline by default')
+    parser.add_argument('--no-write', action='store_true', help='skip the output write stage')
+    parser.add_argument('--startup', action='store_true',
+                        help='measure the import time and memory of the modules instead')
+    parser.add_argument('--output', help='JSON file of the results, printed if not given')
+    return parser.parse_args()
+
+def main():
+    args = parse_args()
+    if args.startup:
+        runs = startup()
+        for run in runs:
+            print(f"import {run['module']}: {run['import_ms']:.0f} ms, {run['peak_rss_mb'] or 0:.0f} MB, "
+                  f"GUI: {', '.join(run['gui_modules']) or 'none'}", file=sys.stderr)
+        report = {'python': platform.python_version(), 'startup': runs}
+        if args.output:
+            with open(args.output, 'w') as f:
+                json.dump(report, f, indent=4)
+        else:
+            print(json.dumps(report, indent=4))
+        return
+    paths = [path for folder in args.input for path in list_images(folder)][::args.stride]
+    if args.limit:
+        paths = paths[:args.limit]
+    if not paths:
+        sys.exit('No image found')
+
+    report = {
+        'created': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'input': args.input,
+        'stride': args.stride,
+        'max_size': args.max_size,
+        'python': platform.python_version(),
+        'opencv': cv2.__version__,
+        'numpy': np.__version__,
+        'machine': platform.machine(),
+        'runs': [],
+    }
+    with tempfile.TemporaryDirectory() as output_folder:
+        for classifier in args.classifier:
+            run = benchmark(paths, classifier, None if args.no_write else output_folder,
+                            args.max_size, args.thresholds)
+            print(f"{classifier}: {run['images']} images, {run['images_per_s']:.1f} images/s, "
+                  f"p50 {run['latency_ms']['p50']:.2f} ms, p99 {run['latency_ms']['p99']:.2f} ms",
+                  file=sys.stderr)
+            report['runs'].append(run)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=4)
+    else:
+        print(json.dumps(report, indent=4))
+
+if __name__ == "__main__":
+    main()
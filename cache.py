@@ -0,0 +1,144 @@
+import json
+import time
+import zlib
+import sqlite3
+import hashlib
+import numpy as np
+
+import common
+from cascade import load_cascade
+from pipeline import PIPELINES
+from shapes import load_index
+
+# Bump when a change of the code (not of the constants) changes the results
+CACHE_VERSION = 1
+CACHE_FILE = 'results_cache.sqlite'
+
+def pipeline_config(classifier, max_size=None):
+    """Every setting the results of a classifier depend on"""
+    pipeline = dict(PIPELINES['images' if classifier == 'cascade' else classifier])
+    # inline and fused thresholds give the same results, they share their cache entries
+    del pipeline['thresholds']
+    config = {
+        'version': CACHE_VERSION,
+        'classifier': classifier,
+        'pipeline': pipeline,
+        'max_size': max_size,
+    }
+    if classifier == 'cascade':
+        cascade = load_cascade()
+        config['cascade'] = (cascade['order'], cascade['threshold'])
+    if config['pipeline']['shape'] == 'template':
+        config['shape_index'] = load_index().digest()
+    return config
+
+def config_key(config):
+    return hashlib.sha1(json.dumps(config, sort_keys=True).encode()).hexdigest()
+
+def file_key(image_path):
+    """Content hash of an image file, the file is not decoded"""
+    with open(image_path, 'rb') as f:
+        return hashlib.sha1(f.read()).hexdigest()
+
+def frame_key(image):
+    """Content hash of a decoded frame"""
+    digest = hashlib.sha1(np.ascontiguousarray(image).data)
+    digest.update(str(image.shape).encode())
+    return digest.hexdigest()
+
+def pack_contour(ctr):
+    """Contour as zlib compressed int32 point deltas (neighbours differ by a pixel or two)"""
+    if ctr is None:
+        return None
+    points = ctr.reshape(-1, 2).astype(np.int32)
+    deltas = np.diff(points, axis=0, prepend=np.zeros((1, 2), np.int32))
+    return zlib.compress(deltas.tobytes())
+
+def unpack_contour(blob):
+    if blob is None:
+        return None
+    deltas = np.frombuffer(zlib.decompress(blob), dtype=np.int32).reshape(-1, 2)
+    return np.cumsum(deltas, axis=0, dtype=np.int32).reshape(-1, 1, 2)
+
+class ResultCache:
+    """On-disk cache of Records keyed by image content and pipeline configuration
+    
+    Backed by SQLite in WAL mode, so several worker processes can share one file.
+    When the stored rows exceed max_bytes the least recently used ones are evicted.
+    """
+    # Inserts between two checks of the cache size
+    EVICT_EVERY = 100
+
+    def __init__(self, path=CACHE_FILE, max_bytes=256 * 2**20):
+        self.path = path
+        self.max_bytes = max_bytes
+        self._db = None
+        self._inserts = 0
+
+    def __getstate__(self):
+        # sent to the worker processes without the connection
+        return {'path': self.path, 'max_bytes': self.max_bytes}
+
+    def __setstate__(self, state):
+        self.__init__(state['path'], state['max_bytes'])
+
+    @property
+    def db(self):
+        if self._db is None:
+            self._db = sqlite3.connect(self.path, timeout=60, isolation_level=None)
+            self._db.execute('PRAGMA journal_mode=WAL')
+            self._db.execute('''CREATE TABLE IF NOT EXISTS results (
+                image_key TEXT, config_key TEXT, shape TEXT, num_vertices INTEGER,
+                score REAL, method TEXT, ctr BLOB, size INTEGER, last_used REAL,
+                PRIMARY KEY (image_key, config_key))''')
+            self._db.execute('CREATE INDEX IF NOT EXISTS results_last_used ON results (last_used)')
+        return self._db
+
+    def get(self, image_key, config_key, filename):
+        """Cached Record of an image, None on a miss"""
+        row = self.db.execute('''SELECT shape, num_vertices, score, method, ctr FROM results
+            WHERE image_key = ? AND config_key = ?''', (image_key, config_key)).fetchone()
+        if row is None:
+            return None
+        self.db.execute('UPDATE results SET last_used = ? WHERE image_key = ? AND config_key = ?',
+                        (time.time(), image_key, config_key))
+        shape, num_vertices, score, method, ctr = row
+        return common.Record(filename, shape, num_vertices, score, method, unpack_contour(ctr))
+
+    def put(self, image_key, config_key, record):
+        """Store a Record, records with an error are not cached"""
+        if record.error:
+            return
+        ctr = pack_contour(record.ctr)
+        size = 64 + (len(ctr) if ctr else 0)
+        self.db.execute('INSERT OR REPLACE INTO results VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                        (image_key, config_key, record.shape, int(record.num_vertices),
+                         float(record.score), record.method, ctr, size, time.time()))
+        self._inserts += 1
+        if self._inserts % self.EVICT_EVERY == 0:
+            self.evict()
+
+    def evict(self):
+        """Remove the least recently used rows until the cache fits in max_bytes"""
+        total = self.db.execute('SELECT COALESCE(SUM(size), 0) FROM results').fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        # keep a margin so the next inserts don't evict again right away
+        excess = total - int(self.max_bytes * 0.9)
+        self.db.execute('BEGIN IMMEDIATE')
+        try:
+            removed = 0
+            for image_key, config_key, size in self.db.execute(
+                    'SELECT image_key, config_key, size FROM results ORDER BY last_used').fetchall():
+                if removed >= excess:
+                    break
+                self.db.execute('DELETE FROM results WHERE image_key = ? AND config_key = ?',
+                                (image_key, config_key))
+                removed += size
+            self.db.execute('COMMIT')
+        except Exception:
+            self.db.execute('ROLLBACK')
+            raise
+
+    def __len__(self):
+        return self.db.execute('SELECT COUNT(*) FROM results').fetchone()[0]
@@ -0,0 +1,126 @@
+import os
+import sys
+import json
+import time
+import argparse
+import cv2
+import numpy as np
+
+import context
+from classifyimages import classifyImages
+from common import list_images
+from pipeline import PIPELINES, get_pipeline
+
+METHODS = PIPELINES['images']['methods']
+
+CASCADE_FILE = 'cascade.json'
+# Used until a cascade is learned: every method in the METHODS order, early exit
+# only on the doubled circularity of a clean circle
+DEFAULT_CASCADE = {'order': [name for name, _ in METHODS], 'threshold': 1.1}
+
+loaded = {}
+
+def load_cascade(path=CASCADE_FILE):
+    """Learned cascade of path, DEFAULT_CASCADE if it was never learned"""
+    if path not in loaded:
+        if os.path.exists(path):
+            with open(path) as f:
+                loaded[path] = json.load(f)
+        else:
+            loaded[path] = DEFAULT_CASCADE
+    return loaded[path]
+
+def classifyByCascade(input_folder, output_folder, headless=False, debug_sample=0, max_size=None,
+                      writer=None, thresholds=None):
+    """classifyImages with the learned early exit cascade of CASCADE_FILE"""
+    classifyImages(input_folder, output_folder, headless, debug_sample, load_cascade(), max_size, writer,
+                   thresholds)
+
+def collect_statistics(paths):
+    """Run every method on every image, returns (scores, shapes, costs)
+    
+    Each is an (images, methods) array in the METHODS order, costs are the seconds
+    spent in the stages of the method (threshold, canny, findContours, scoring).
+    """
+    scores = np.zeros((len(paths), len(METHODS)))
+    costs = np.zeros((len(paths), len(METHODS)))
+    shapes = np.empty((len(paths), len(METHODS)), dtype=object)
+    for i, path in enumerate(paths):
+        image = cv2.imread(path)
+        if image is None:
+            continue
+        ctx = context.ImageContext(image)
+        ctx.blurred(PIPELINES['images']['preprocess'])
+        for j, (thresh_name, _) in enumerate(METHODS):
+            start = time.perf_counter()
+            result = get_pipeline('images').classify_method(ctx, thresh_name)
+            costs[i, j] = time.perf_counter() - start
+            scores[i, j] = result.score
+            shapes[i, j] = result.shape
+    return scores, shapes, costs
+
+def simulate(order, threshold, scores, shapes, costs):
+    """Run the cascade on collected statistics, returns (agreement, mean cost)
+    
+    agreement is the share of images where the cascade gives the same shape as
+    running every method.
+    """
+    rows = np.arange(len(scores))
+    full = shapes[rows, np.argmax(scores, axis=1)]
+    ordered = scores[:, order]
+    # the cascade stops at the first method reaching the threshold, or at the last one
+    reached = np.maximum.accumulate(ordered, axis=1) >= threshold
+    stop = np.where(reached.any(axis=1), np.argmax(reached, axis=1), len(order) - 1)
+    run = np.arange(len(order)) <= stop[:, None]
+    winner = np.argmax(np.where(run, ordered, -np.inf), axis=1)
+    cascade = shapes[:, order][rows, winner]
+    cost = (costs[:, order] * run).sum(axis=1).mean()
+    return float(np.mean(cascade == full)), float(cost)
+
+def learn_cascade(scores, shapes, costs, target=0.99):
+    """Order the methods by wins per second and pick the cheapest threshold
+    whose agreement with running every method is at least target"""
+    names = [name for name, _ in METHODS]
+    wins = np.bincount(np.argmax(scores, axis=1), minlength=len(names))
+    mean_costs = costs.mean(axis=0)
+    order = sorted(range(len(names)), key=lambda j: -wins[j] / mean_costs[j])
+
+    candidates = np.unique(np.percentile(scores[scores > 0], np.arange(0, 101, 2)))
+    best = (np.inf, *simulate(order, np.inf, scores, shapes, costs))
+    for threshold in candidates:
+        agreement, cost = simulate(order, threshold, scores, shapes, costs)
+        if agreement >= target and cost < best[2]:
+            best = (float(threshold), agreement, cost)
+    threshold, agreement, cost = best
+    full_cost = float(costs.sum(axis=1).mean())
+    return {
+        'order': [names[j] for j in order],
+        'threshold': threshold if np.isfinite(threshold) else None,
+        'agreement': agreement,
+        'speedup': full_cost / cost if cost else 1.0,
+        'images': len(scores),
+        'wins': {name: int(w) for name, w in zip(names, wins)},
+        'method_ms': {name: float(c * 1000) for name, c in zip(names, mean_costs)},
+    }
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Learn the early exit cascade of classifyImages')
+    parser.add_argument('--input', nargs='+', default=['traffic_Data/DATA'])
+    parser.add_argument('--stride', type=int, default=1, help='learn on every n-th image only')
+    parser.add_argument('--target', type=float, default=0.99,
+                        help='minimum share of images classified as without the cascade')
+    parser.add_argument('--output', default=CASCADE_FILE)
+    return parser.parse_args()
+
+def main():
+    args = parse_args()
+    paths = [path for folder in args.input for path in list_images(folder)][::args.stride]
+    if not paths:
+        sys.exit('No image found')
+    cascade = learn_cascade(*collect_statistics(paths), args.target)
+    with open(args.output, 'w') as f:
+        json.dump(cascade, f, indent=4)
+    print(json.dumps(cascade, indent=4))
+
+if __name__ == "__main__":
+    main()
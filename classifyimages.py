@@ -1,136 +1,74 @@
-import os
 import cv2
-import numpy as np
-from matplotlib import pyplot as plt
-from collections.abc import Mapping
 
-import common 
+import common
+import pipeline
+import scoring
 
-def classifyImages(input_folder, output_folder):
-    """classify traffic symbols by best quality methods"""
+def classifyImages(input_folder, output_folder, headless=False, debug_sample=0, cascade=None, max_size=None,
+                   writer=None, thresholds=None):
+    """classify traffic symbols by best quality methods
     
-    shapes = ['triangle', 'circle', 'rectangle', 'octagon', 'unknown']
-    for shape in shapes:
-        path = os.path.join(output_folder, shape)
-        os.makedirs(path, exist_ok=True)
-    
-    for filename in os.listdir(input_folder):
-        if not filename.lower().endswith(('.png', '.jpg', '.jpeg', '.bmp')):
-            continue
-        
-        image_path = os.path.join(input_folder, filename)
-        image = cv2.imread(image_path)
-        
-        if image is None:
-            print(f"Image Couldn't Read: {filename}")
-            continue
+    The stages are configured by pipeline.PIPELINES['images'], see pipeline.classifyFolder
+    for the options.
+    cascade: early exit cascade of the threshold methods, see pipeline.Pipeline.run
+    """
+    pipeline.classifyFolder(input_folder, output_folder, 'images', show_panels, headless,
+                            debug_sample, max_size, cascade=cascade, writer=writer, thresholds=thresholds)
+
+def classifyByTemplate(input_folder, output_folder, headless=False, debug_sample=0, max_size=None,
+                       writer=None, thresholds=None):
+    """classifyImages with the shapes labeled by the nearest template of shapes.py"""
+    pipeline.classifyFolder(input_folder, output_folder, 'template', show_panels, headless,
+                            debug_sample, max_size, writer=writer, thresholds=thresholds)
+
+# Other preprocessing tried, see context.PREPROCESSING for the selectable ones:
+# blurred = cv2.medianBlur(gray, 3)
+# blurred = cv2.bilateralFilter(gray, 9, 75, 75)
+# blurred = cv2.filter2D(gray, -1, cv2.getGaussianKernel(3, 0))
 
-        gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
-        blurred = cv2.GaussianBlur(gray,(3, 3), sigmaX=0, sigmaY=0)
-        # blurred = cv2.medianBlur(gray, 3)
-        # blurred = cv2.bilateralFilter(gray, 9, 75, 75)
-        # blurred = cv2.filter2D(gray, -1, cv2.getGaussianKernel(3, 0))
-        
-        # prewitt filter:
-        
-        # kernelx = np.array([[1,1,1],[0,0,0],[-1,-1,-1]])
-        # kernely = np.array([[-1,0,1],[-1,0,1],[-1,0,1]])
-        # img_prewittx = cv2.filter2D(blurred, -1, kernelx)
-        # img_prewitty = cv2.filter2D(blurred, -1, kernely)
-        # img_prewitt = img_prewittx + img_prewitty
-        
-        # Sobel filter:
-        # soblex = cv2.Sobel(blurred, cv2.CV_64F, 1, 0, ksize=3)
-        # sobley = cv2.Sobel(blurred, cv2.CV_64F, 0, 1, ksize=3)
-        # sobel = cv2.magnitude(soblex, sobley)
-        # sobel = cv2.normalize(sobel, None, 0, 255, cv2.NORM_MINMAX, cv2.CV_8U)
-        
-        
-        common.init_gui(filename,image,blurred,gray)
+# prewitt filter:
 
-        # preprocessing
-        methods = [
-            ('Otsu Binary', cv2.threshold(blurred, 0, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU)[1]),
-            ('Adaptive Gaussian', cv2.adaptiveThreshold(blurred, 255, 
-                                    cv2.ADAPTIVE_THRESH_GAUSSIAN_C, 
-                                    cv2.THRESH_BINARY_INV, 11, 2)),
-            ('Adaptive Mean', cv2.adaptiveThreshold(blurred, 255, 
-                                cv2.ADAPTIVE_THRESH_MEAN_C, 
-                                cv2.THRESH_BINARY_INV, 11, 2)),
-            ('No-Threshold', blurred)
-            #('Prewitt', cv2.threshold(img_prewitt, 0, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU)[1])
-            #('Sobel', cv2.threshold(sobel, 0, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU)[1])
-        ]
-        idx = 0
-        results: Mapping[str,common.Result] = {}
-        for (thresh_name, thresh) in methods:
-            edges = cv2.Canny(thresh, 60, 180)
-            ctrs, _ = cv2.findContours(edges, cv2.RETR_TREE, cv2.CHAIN_APPROX_NONE)
-            ctrs = [cnt for cnt in ctrs if cv2.contourArea(cnt) > 100]
-            #return best contours else return 0 0 contour
-            if ctrs: 
-                for ctr in ctrs:
-                    quality_score = evaluate_contour_quality(ctr, image.shape[:2])
-                    if not thresh_name in results:
-                        results[thresh_name] = common.Result(thresh_name,quality_score,ctr)
-                    elif results[thresh_name].score <= quality_score:
-                        results[thresh_name] = common.Result(thresh_name,quality_score,ctr)
-            else:
-                results[thresh_name] = common.Result(thresh_name, 0)
-            plt.subplot(3,4,5+idx)
-            idx+=1
-            plt.title(f'4.{idx}. {thresh_name}')
-            plt.imshow(thresh, cmap='gray')
-            plt.axis('off')
-            plt.subplot(3, 4, 8+idx)
-            plt.title(f'5.{idx}. Canny:({thresh_name})\n{results[thresh_name]}')
-            plt.imshow(edges, cmap='gray')
-            plt.axis('off')
-        
-        result_img = image.copy()
-        best_contour:str = max(results, key=lambda k: results[k].getScore())
+# kernelx = np.array([[1,1,1],[0,0,0],[-1,-1,-1]])
+# kernely = np.array([[-1,0,1],[-1,0,1],[-1,0,1]])
+# img_prewittx = cv2.filter2D(blurred, -1, kernelx)
+# img_prewitty = cv2.filter2D(blurred, -1, kernely)
+# img_prewitt = img_prewittx + img_prewitty
 
-        cv2.drawContours(result_img, results[best_contour].ctr, -1, (0,255,0), 2)
-        plt.subplot(3,4,4)
-        plt.title(f'6. Final Result\n Canny:({best_contour})\n Shape:{results[best_contour].shape}')
-        plt.imshow(cv2.cvtColor(result_img, cv2.COLOR_BGR2RGB))
+# Sobel filter:
+# soblex = cv2.Sobel(blurred, cv2.CV_64F, 1, 0, ksize=3)
+# sobley = cv2.Sobel(blurred, cv2.CV_64F, 0, 1, ksize=3)
+# sobel = cv2.magnitude(soblex, sobley)
+# sobel = cv2.normalize(sobel, None, 0, 255, cv2.NORM_MINMAX, cv2.CV_8U)
+
+def show_panels(filename, image, best, results, stages, debug_folder=None):
+    """Draw the 12 debug panels of one image, saved to debug_folder if it is given"""
+    # matplotlib is only loaded once panels are drawn
+    from gui import DEBUG_FIGSIZE, finish_gui, init_gui, plt
+    image = common.color_copy(image)
+    result_img = image.copy()
+    cv2.drawContours(result_img, best.ctr, -1, (0,255,0), 2)
+    init_gui(filename, image, stages['blurred'], stages['gray'],
+             DEBUG_FIGSIZE if debug_folder else None)
+    for idx, (thresh_name, thresh, edges) in enumerate(stages['methods'], start=1):
+        plt.subplot(3,4,4+idx)
+        plt.title(f'4.{idx}. {thresh_name}')
+        plt.imshow(thresh, cmap='gray')
+        plt.axis('off')
+        plt.subplot(3, 4, 8+idx)
+        plt.title(f'5.{idx}. Canny:({thresh_name})\n{results[thresh_name]}')
+        plt.imshow(edges, cmap='gray')
         plt.axis('off')
 
-        shape = results[best_contour].shape
-        save_path = os.path.join(output_folder, shape, filename)
-        cv2.imwrite(save_path, result_img)
-        
-        plt.tight_layout()   
-        plt.subplots_adjust(top=0.92, hspace=0.274)    # Adjust the subplot     
-        plt.show()
-        print(f'{filename} saved to {shape} folder\n')
+    plt.subplot(3,4,4)
+    plt.title(f'6. Final Result\n Canny:({best.method})\n Shape:{best.shape}')
+    plt.imshow(cv2.cvtColor(result_img, cv2.COLOR_BGR2RGB))
+    plt.axis('off')
+
+    plt.tight_layout()   
+    plt.subplots_adjust(top=0.92, hspace=0.274)    # Adjust the subplot     
+    finish_gui(filename, debug_folder)
 
 def evaluate_contour_quality(contour, image_shape):
     """Evaluate the quality of a contour based on its area and perimeter"""
-    area = cv2.contourArea(contour)
-    perimeter = cv2.arcLength(contour, True)
-    
-    # Regularity of shape (closer to 1 means more regular)
-    circularity = 4 * np.pi * area / (perimeter * perimeter) if perimeter > 0 else 0
-    
-    # Center distance
-    moments = cv2.moments(contour)
-    if moments['m00'] != 0:
-        cx = moments['m10'] / moments['m00']
-        cy = moments['m01'] / moments['m00']
-        center_dist = np.sqrt((cx - image_shape[1]/2)**2 + (cy - image_shape[0]/2)**2)
-        center_score = 1 - (center_dist / (np.sqrt(image_shape[0]**2 + image_shape[1]**2)/2))
-    else:
-        center_score = 0
-    
-    # The size of the contour (not too small or too large)
-    total_area = image_shape[0] * image_shape[1]
-    area_ratio = area / total_area
-    size_score = 1 - abs(0.4 - area_ratio) if area_ratio <= 0.9 else 0
-    if circularity >= 0.8:
-        circularity*=2
-    # Total score calculation (We can adjust the weights)
-    total_score = (0.3 * circularity + 
-                  0.3 * center_score + 
-                  0.4 * size_score)
-    return total_score
\ No newline at end of file
+    features = scoring.contour_features([contour])
+    return float(scoring.score_contours(features, image_shape, scoring.IMAGES_SCORING)[0])
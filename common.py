@@ -1,12 +1,36 @@
 import cv2
-from matplotlib import pyplot as plt
 import numpy as np
-import detect_screen_size
+import os
+from typing import NamedTuple
 
-def detect_shape(contour):
-    """Advanced function to detect the shape of a contour"""
-    perimeter = cv2.arcLength(contour, True)
-    approx = cv2.approxPolyDP(contour, 0.01 * perimeter, True)
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.bmp')
+# Classifier names of the batch engines (parallel, stream, benchmark, evaluate)
+CLASSIFIERS = ('images', 'largest', 'quality', 'cascade', 'template')
+
+def list_images(input_folder):
+    """All images under input_folder (class folders included), in a stable order"""
+    paths = []
+    for root, dirs, files in os.walk(input_folder):
+        dirs.sort()
+        paths.extend(os.path.join(root, f) for f in sorted(files)
+                     if f.lower().endswith(IMAGE_EXTENSIONS))
+    return paths
+
+def image_name(image_path, input_folder):
+    """Name of an image in its Record and output folder: its path relative to input_folder
+    
+    Images of different class folders may share a filename, their relative paths differ.
+    """
+    return os.path.relpath(image_path, input_folder).replace(os.sep, '/')
+
+def detect_shape(contour, approx=None):
+    """Advanced function to detect the shape of a contour
+    
+    approx: its approxPolyDP polygon (epsilon 0.01) if it is already computed
+    """
+    if approx is None:
+        perimeter = cv2.arcLength(contour, True)
+        approx = cv2.approxPolyDP(contour, 0.01 * perimeter, True)
     num_vertices = len(approx)
     
     if num_vertices == 3:
@@ -24,8 +48,37 @@ def detect_shape(contour):
     else:
         return 'unknown', num_vertices
     
+class Record(NamedTuple):
+    """Classification of one image, as returned by the batch engines
+    
+    box is the (x0, y0, x1, y1) bounding box of a sign for the multi-sign detection
+    """
+    filename: str
+    shape: str
+    num_vertices: int = 0
+    score: float = 0
+    method: str = None
+    ctr: np.ndarray = None
+    error: str = None
+    box: tuple = None
+
+    def to_dict(self):
+        """JSON serializable form, the contour becomes a list of [x, y] points"""
+        record = self._asdict()
+        if self.ctr is not None:
+            record['ctr'] = self.ctr.reshape(-1, 2).tolist()
+        return record
+
 class Result:
-    def __init__(self, method, score, ctr=np.array([[0,0]]).reshape((-1,1,2)).astype(np.int32)):
+    """Shape of the best contour of one threshold method
+    
+    area, perimeter and approx (a function epsilon -> approxPolyDP polygon) can be
+    given when they are already known, otherwise they are computed from ctr.
+    Contours of circularity >= circle_cutoff are circles, the others are classified by
+    the vertices of their approxPolyDP polygon (epsilon relative to the perimeter).
+    """
+    def __init__(self, method, score, ctr=np.array([[0,0]]).reshape((-1,1,2)).astype(np.int32),
+                 area=None, perimeter=None, approx=None, epsilon=0.015, circle_cutoff=0.8):
         self.method = method
         self.num_vertices=0
         self.score = score
@@ -33,13 +86,18 @@ class Result:
         if self.score == 0:
             self.shape='Not Found'
             return
-        area = cv2.contourArea(self.ctr)
-        perimeter = cv2.arcLength(self.ctr, True)
+        if area is None:
+            area = cv2.contourArea(self.ctr)
+        if perimeter is None:
+            perimeter = cv2.arcLength(self.ctr, True)
         circularity = 4 * np.pi * area / (perimeter * perimeter) if perimeter > 0 else 0
-        if circularity >= 0.8:
+        if circularity >= circle_cutoff:
             self.shape="circle"
             return
-        approx = cv2.approxPolyDP(self.ctr, 0.015 * perimeter, True)
+        if approx is None:
+            approx = cv2.approxPolyDP(self.ctr, epsilon * perimeter, True)
+        else:
+            approx = approx(epsilon)
         self.num_vertices = len(approx)
         match self.num_vertices:
             case 3:
@@ -57,6 +115,35 @@ class Result:
             case _:
                 self.shape='Unknown'
         
+    @classmethod
+    def from_contours(cls, method, score, contours, index, epsilon=0.015, circle_cutoff=0.8):
+        """Result of one contour of a context.Contours set, reusing its memoized geometry"""
+        approx = lambda epsilon: contours.approx(index, epsilon)
+        if contours.scale != (1, 1):
+            # found on a downscaled image, the shape is classified in original coordinates
+            return cls(method, score, contours.original(index), approx=approx,
+                       epsilon=epsilon, circle_cutoff=circle_cutoff)
+        features = contours.features
+        return cls(method, score, contours.ctrs[index], features.area[index],
+                   features.perimeter[index], approx, epsilon, circle_cutoff)
+
+    @classmethod
+    def from_shape(cls, method, score, ctr, shape, num_vertices=0):
+        """Result of a contour already classified by another shape labeller"""
+        result = cls.__new__(cls)
+        result.method = method
+        result.score = score
+        result.ctr = ctr
+        result.shape = shape
+        result.num_vertices = num_vertices
+        return result
+
+    @classmethod
+    def from_vertices(cls, method, score, contours, index, epsilon=0.01):
+        """Result of one contour classified by detect_shape (vertex count only)"""
+        ctr = contours.original(index)
+        return cls.from_shape(method, score, ctr, *detect_shape(ctr, contours.approx(index, epsilon)))
+
     def getEdgeNum(self) -> int:
         if self.score == 0:
             return 0
@@ -70,23 +157,29 @@ class Result:
             return(f'Shape:{self.shape}\nScore:{self.score}')
 
 
-def init_gui(filename,image,blurred,gray):
-    # Get the screen size
-    weight, height = detect_screen_size.detect_screen_size()
-    # To visualize the results
-    plt.figure(figsize=(weight, height))
-    # Original image
-    plt.subplot(3, 4, 1)
-    plt.title(f'1. Original Image {filename}')
-    plt.imshow(cv2.cvtColor(image, cv2.COLOR_BGR2RGB))
-    plt.axis('off')
-    # Grayscale
-    plt.subplot(3, 4, 2)
-    plt.title('2. Grayscale')
-    plt.imshow(gray, cmap='gray')
-    plt.axis('off')
-    # Blurred
-    plt.subplot(3, 4, 3)
-    plt.title('3. Gaussian Blurred')
-    plt.imshow(blurred, cmap='gray')
-    plt.axis('off')
+def color_copy(image, dst=None):
+    """BGR copy of an image to draw on, grayscale images are converted
+
+    dst: the (height, width, 3) array to copy into, a new one by default
+    """
+    if image.ndim == 2:
+        return cv2.cvtColor(image, cv2.COLOR_GRAY2BGR, dst=dst)
+    if dst is None:
+        return image.copy()
+    np.copyto(dst, image)
+    return dst
+
+def init_debug_folder(output_folder, headless, debug_sample):
+    """Create the folder for the sampled debug panels, None if nothing is saved"""
+    if not headless or debug_sample <= 0:
+        return None
+    # No window can be opened, the sampled figures are rendered off-screen
+    import gui
+    gui.use_headless()
+    debug_folder = os.path.join(output_folder, 'debug')
+    os.makedirs(debug_folder, exist_ok=True)
+    return debug_folder
+
+def is_debug_sample(count, debug_sample):
+    """Every debug_sample-th image gets its panels saved, 0 disables it"""
+    return debug_sample > 0 and count % debug_sample == 0
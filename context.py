@@ -0,0 +1,324 @@
+import cv2
+import time
+import numpy as np
+from functools import partial
+
+import instrument
+import kernels
+import scoring
+
+# Every stage function takes an optional dst array to write into (see ImageContext.stage)
+
+def otsu(blurred, dst=None):
+    return cv2.threshold(blurred, 0, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU, dst=dst)[1]
+
+def otsu_inv(blurred, dst=None):
+    return cv2.threshold(blurred, 0, 255, cv2.THRESH_BINARY_INV + cv2.THRESH_OTSU, dst=dst)[1]
+
+def adaptive_gaussian(blurred, block_size=11, c=2, dst=None):
+    return cv2.adaptiveThreshold(blurred, 255, cv2.ADAPTIVE_THRESH_GAUSSIAN_C,
+                                 cv2.THRESH_BINARY_INV, block_size, c, dst=dst)
+
+def adaptive_mean(blurred, block_size=11, c=2, dst=None):
+    return cv2.adaptiveThreshold(blurred, 255, cv2.ADAPTIVE_THRESH_MEAN_C,
+                                 cv2.THRESH_BINARY_INV, block_size, c, dst=dst)
+
+def canny(blurred, low, high, dst=None):
+    return cv2.Canny(blurred, low, high, edges=dst)
+
+def no_threshold(blurred, dst=None):
+    return blurred
+
+# A threshold method is a tuple (kind, *params), e.g. ('adaptive_mean', 11, 2)
+THRESHOLDS = {
+    'otsu': otsu,
+    'otsu_inv': otsu_inv,
+    'adaptive_gaussian': adaptive_gaussian,
+    'adaptive_mean': adaptive_mean,
+    'canny': canny,
+    'none': no_threshold,
+}
+
+def gaussian(gray, ksize, dst=None):
+    return cv2.GaussianBlur(gray, (ksize, ksize), 0, dst=dst)
+
+def median(gray, ksize, dst=None):
+    return cv2.medianBlur(gray, ksize, dst=dst)
+
+def bilateral(gray, diameter=9, sigma_color=75, sigma_space=75, dst=None):
+    return cv2.bilateralFilter(gray, diameter, sigma_color, sigma_space, dst=dst)
+
+# A preprocessing is a tuple (kind, *params) applied to the grayscale image, e.g. ('gaussian', 3)
+PREPROCESSING = {
+    'gaussian': gaussian,
+    'median': median,
+    'bilateral': bilateral,
+}
+
+def normalize_resolution(image, max_size):
+    """Downscale image so its larger side is at most max_size, returns (image, scale)
+    
+    The image is halved with pyrDown while it is at least twice too large and the
+    rest is resized with INTER_AREA, both average the pixels they merge.
+    scale is the (x, y) factor from the returned image back to the original one.
+    """
+    height, width = image.shape[:2]
+    if max_size is None or max(height, width) <= max_size:
+        return image, (1, 1)
+    small = image
+    while max(small.shape[:2]) >= 2 * max_size:
+        small = cv2.pyrDown(small)
+    ratio = max(small.shape[:2]) / max_size
+    if ratio > 1:
+        size = (max(1, round(small.shape[1] / ratio)), max(1, round(small.shape[0] / ratio)))
+        small = cv2.resize(small, size, interpolation=cv2.INTER_AREA)
+    return small, (width / small.shape[1], height / small.shape[0])
+
+def stage_name(key):
+    """Name of a memoized stage in the timings, thresholds are named by their kind
+    
+    e.g. 'threshold canny', apart from the 'canny' edge detection of every method.
+    None for the stages that time their parts themselves.
+    """
+    if key == 'gray':
+        return 'grayscale'
+    if key[0] == 'blurred':
+        return 'blur'
+    if key[0] == 'threshold':
+        return f'threshold {key[2][0]}'
+    if key[0] == 'thresholds':
+        # a fused pass times every threshold kind itself (see ImageContext.compute_thresholds)
+        return None
+    if key[0] == 'edges':
+        return 'canny'
+    return 'findContours'
+
+def add_timing(timings, stage, seconds):
+    timings[stage] = timings.get(stage, 0) + seconds
+
+class ImageContext:
+    """Memoizes every derived image of one input, so no stage runs twice on it
+    
+    Stages are keyed by their parameters, classifiers with different settings
+    share what they have in common (e.g. the grayscale image).
+    timings: optional dict, the seconds spent in every stage are added to it
+    max_size: the stages run on the image downscaled to this larger side (see
+    normalize_resolution), contours are mapped back with Contours.original
+    bank: once fused_thresholds ran, the stage images are written into the reusable
+    buffers of this kernels.KernelBank, they stay valid until the thread's next image
+    """
+    def __init__(self, image, timings=None, max_size=None):
+        self.original = image
+        self.timings = timings
+        # the stages are traced while instrument tracing is enabled
+        self.tracer = instrument.active
+        start = time.perf_counter()
+        self.image, self.scale = normalize_resolution(image, max_size)
+        if self.scale != (1, 1):
+            self.timed('resize', start)
+        self.shape = self.image.shape[:2]
+        self.cache = {}
+        self.bank = None
+
+    def memo(self, key, compute, *args):
+        if key not in self.cache:
+            if (self.timings is None and self.tracer is None) or stage_name(key) is None:
+                self.cache[key] = compute(*args)
+            else:
+                start = time.perf_counter()
+                self.cache[key] = compute(*args)
+                self.timed(stage_name(key), start, key)
+        return self.cache[key]
+
+    def stage(self, key, compute, *args):
+        """memo of a stage image, written into a buffer of the bank if the context has one"""
+        if self.bank is not None and key not in self.cache:
+            return self.memo(key, partial(compute, dst=self.bank.buffer(key, self.shape)), *args)
+        return self.memo(key, compute, *args)
+
+    def timed(self, stage, start, key=None):
+        """Add the seconds since start to the timings and the trace of a stage"""
+        seconds = time.perf_counter() - start
+        if self.timings is not None:
+            add_timing(self.timings, stage, seconds)
+        if self.tracer is not None:
+            args = {} if key is None or key == 'gray' else {'params': repr(key[1:])}
+            self.tracer.add_span(stage, start, seconds, **args)
+
+    def gray(self):
+        if self.image.ndim == 2:
+            # decoded in grayscale already
+            return self.image
+        return self.stage('gray', cv2.cvtColor, self.image, cv2.COLOR_BGR2GRAY)
+
+    def blurred(self, preprocess):
+        kind, *params = preprocess
+        return self.stage(('blurred', preprocess), PREPROCESSING[kind], self.gray(), *params)
+
+    def threshold(self, preprocess, method):
+        kind, *params = method
+        return self.stage(('threshold', preprocess, method), THRESHOLDS[kind],
+                          self.blurred(preprocess), *params)
+
+    def fused_thresholds(self, preprocess, methods):
+        """Memoize the threshold methods in one kernels.KernelBank pass over the blurred image
+
+        The methods share their Otsu histogram and adaptive local means, the outputs
+        are the same as threshold. From now on the stages of this image are written
+        into the buffers of the bank of this thread.
+        """
+        if self.bank is None:
+            self.bank = kernels.local_bank()
+        self.memo(('thresholds', preprocess, tuple(methods)), self.compute_thresholds,
+                  self.blurred(preprocess), preprocess, methods)
+
+    def compute_thresholds(self, blurred, preprocess, methods):
+        keys = {method: ('threshold', preprocess, method) for method in methods}
+        dsts = {method: self.bank.buffer(('fused',) + key, self.shape) for method, key in keys.items()}
+        timed = None
+        if self.timings is not None or self.tracer is not None:
+            timed = lambda kind, start: self.timed(f'threshold {kind}', start)
+        results = self.bank.thresholds(blurred, methods, dsts, timed)
+        # the whole pass runs so its cost is complete, the images memoized already are kept
+        for method, key in keys.items():
+            self.cache.setdefault(key, results[method])
+        return results
+
+    def edges(self, preprocess, method, limits):
+        return self.stage(('edges', preprocess, method, limits), canny,
+                          self.threshold(preprocess, method), *limits)
+
+    def contours(self, preprocess, method, limits, mode, approx):
+        """Contours of the edges of one threshold method, as a Contours set"""
+        return self.memo(('contours', preprocess, method, limits, mode, approx), self.find_contours,
+                         self.edges(preprocess, method, limits), mode, approx)
+
+    def find_contours(self, edges, mode, approx):
+        ctrs, hierarchy = cv2.findContours(edges, mode, approx)
+        return Contours(ctrs, self.shape, self.timings, self.scale, self.tracer,
+                        hierarchy, dense=approx == cv2.CHAIN_APPROX_NONE)
+
+def box_areas(contours):
+    """Area of the bounding box (between the extreme points) of every contour"""
+    lengths = np.fromiter((len(c) for c in contours), dtype=np.intp, count=len(contours))
+    points = np.concatenate(contours).reshape(-1, 2)
+    starts = np.zeros(len(contours), dtype=np.intp)
+    np.cumsum(lengths[:-1], out=starts[1:])
+    size = np.maximum.reduceat(points, starts) - np.minimum.reduceat(points, starts)
+    return size[:, 0].astype(np.float64) * size[:, 1]
+
+class Contours:
+    """Contours of one edge image with their memoized per contour quantities
+    
+    scale: (x, y) factor back to the original image when the contours were found
+    on a downscaled one. features and scores are in the downscaled units.
+    hierarchy: the findContours hierarchy, dense: every boundary pixel is a point
+    (CHAIN_APPROX_NONE), both are only used by reduced
+    """
+    def __init__(self, ctrs, image_shape, timings=None, scale=(1, 1), tracer=None,
+                 hierarchy=None, dense=False):
+        self.ctrs = ctrs
+        self.image_shape = image_shape
+        self.timings = timings
+        self.tracer = tracer
+        self.scale = scale
+        self.area_scale = scale[0] * scale[1]
+        self.hierarchy = hierarchy
+        self.dense = dense
+        self._features = None
+        self._scores = {}
+        self._approx = {}
+        self._original = {}
+        self._reduced = {}
+
+    def __len__(self):
+        return len(self.ctrs)
+
+    @property
+    def features(self):
+        """area, perimeter and centroid of every contour (scoring.ContourFeatures)"""
+        if self._features is None:
+            start = time.perf_counter()
+            self._features = scoring.contour_features(self.ctrs)
+            self.timed('scoring', start)
+        return self._features
+
+    def depths(self):
+        """Nesting depth of every contour in the hierarchy, 0 for the outer ones"""
+        parent = self.hierarchy[0][:, 3]
+        depth = np.zeros(len(parent), dtype=np.intp)
+        ancestor = parent.copy()
+        while (ancestor >= 0).any():
+            depth += ancestor >= 0
+            ancestor = np.where(ancestor >= 0, parent[ancestor], -1)
+        return depth
+
+    def reduced(self, min_area=None, max_depth=None):
+        """Contours set without the contours that can't be selected, in the same order
+        
+        Contours nested deeper than max_depth in the hierarchy are dropped, then the
+        contours too small to be larger than min_area pixels: the isoperimetric bound of
+        their point count first (dense chains only), then their bounding box. Both bound
+        the exact area from above, so no contour passing area_mask(min_area) is lost.
+        """
+        key = (min_area, max_depth)
+        if key not in self._reduced:
+            start = time.perf_counter()
+            keep = np.arange(len(self.ctrs))
+            if max_depth is not None and len(keep):
+                keep = keep[self.depths() <= max_depth]
+            if min_area is not None and len(keep):
+                # area <= perimeter**2 / (4 pi) and a step of a dense chain is at most sqrt(2)
+                if self.dense:
+                    lengths = np.fromiter((len(self.ctrs[i]) for i in keep), dtype=np.float64, count=len(keep))
+                    keep = keep[lengths * lengths / (2 * np.pi) * self.area_scale > min_area]
+                if len(keep):
+                    keep = keep[box_areas([self.ctrs[i] for i in keep]) * self.area_scale > min_area]
+            ctrs = [self.ctrs[i] for i in keep]
+            self._reduced[key] = Contours(ctrs, self.image_shape, self.timings, self.scale, self.tracer)
+            self.timed('prefilter', start)
+        return self._reduced[key]
+
+    def scores(self, params):
+        """Quality scores of every contour for one scoring parameter set"""
+        key = tuple(sorted(params.items()))
+        if key not in self._scores:
+            features = self.features
+            start = time.perf_counter()
+            self._scores[key] = scoring.score_contours(features, self.image_shape, params)
+            self.timed('scoring', start)
+        return self._scores[key]
+
+    def area_mask(self, min_area):
+        """Contours larger than min_area pixels of the original image"""
+        return self.features.area * self.area_scale > min_area
+
+    def original(self, index):
+        """One contour in the coordinates of the original image"""
+        if self.scale == (1, 1):
+            return self.ctrs[index]
+        if index not in self._original:
+            # pixel centers are mapped, not pixel corners
+            points = (self.ctrs[index] + 0.5) * self.scale - 0.5
+            self._original[index] = np.round(points).astype(np.int32)
+        return self._original[index]
+
+    def approx(self, index, epsilon):
+        """approxPolyDP of one contour in original coordinates, epsilon is relative to its perimeter"""
+        key = (index, epsilon)
+        if key not in self._approx:
+            ctr = self.original(index)
+            start = time.perf_counter()
+            if self.scale == (1, 1):
+                perimeter = self.features.perimeter[index]
+            else:
+                perimeter = cv2.arcLength(ctr, True)
+            self._approx[key] = cv2.approxPolyDP(ctr, epsilon * perimeter, True)
+            self.timed('shape', start)
+        return self._approx[key]
+
+    def timed(self, stage, start):
+        if self.timings is not None:
+            add_timing(self.timings, stage, time.perf_counter() - start)
+        if self.tracer is not None:
+            self.tracer.add_span(stage, start, time.perf_counter() - start, contours=len(self.ctrs))
@@ -0,0 +1,108 @@
+import sys
+import json
+import argparse
+import cv2
+import numpy as np
+
+import context
+from common import CLASSIFIERS, list_images
+from parallel import classify_record
+
+# HSV ranges (OpenCV hue is 0-179) of the sign colors used to propose regions
+HUE_RANGES = {
+    'red': [((0, 70, 50), (10, 255, 255)), ((170, 70, 50), (179, 255, 255))],
+    'blue': [((100, 70, 50), (130, 255, 255))],
+}
+
+def propose_regions(image, min_size=16, max_aspect=2.5, margin=0.15):
+    """Candidate sign boxes (x0, y0, x1, y1) from the red and blue color masks
+    
+    Boxes smaller than min_size pixels or longer than max_aspect are dropped, the
+    others are grown by margin of their size so the whole sign outline is inside.
+    """
+    hsv = cv2.cvtColor(image, cv2.COLOR_BGR2HSV)
+    mask = np.zeros(image.shape[:2], dtype=np.uint8)
+    for ranges in HUE_RANGES.values():
+        for low, high in ranges:
+            mask |= cv2.inRange(hsv, np.array(low), np.array(high))
+    # join the broken rims of the signs
+    mask = cv2.morphologyEx(mask, cv2.MORPH_CLOSE, np.ones((5, 5), np.uint8))
+    count, _, stats, _ = cv2.connectedComponentsWithStats(mask)
+    x, y, w, h = stats[1:, 0], stats[1:, 1], stats[1:, 2], stats[1:, 3]
+    keep = (np.minimum(w, h) >= min_size) & (np.maximum(w, h) <= max_aspect * np.minimum(w, h))
+    dx, dy = (w * margin).astype(int), (h * margin).astype(int)
+    height, width = image.shape[:2]
+    boxes = np.stack([np.maximum(0, x - dx), np.maximum(0, y - dy),
+                      np.minimum(width, x + w + dx), np.minimum(height, y + h + dy)], axis=1)
+    return boxes[keep]
+
+def box_iou(box, boxes):
+    """IoU of one (x0, y0, x1, y1) box with an (n, 4) array of boxes"""
+    x0 = np.maximum(box[0], boxes[:, 0])
+    y0 = np.maximum(box[1], boxes[:, 1])
+    x1 = np.minimum(box[2], boxes[:, 2])
+    y1 = np.minimum(box[3], boxes[:, 3])
+    intersection = np.clip(x1 - x0, 0, None) * np.clip(y1 - y0, 0, None)
+    area = (box[2] - box[0]) * (box[3] - box[1])
+    areas = (boxes[:, 2] - boxes[:, 0]) * (boxes[:, 3] - boxes[:, 1])
+    return intersection / np.maximum(area + areas - intersection, 1)
+
+def non_max_suppression(boxes, scores, iou_threshold=0.3):
+    """Indices of the boxes kept, highest score first, overlapping boxes are removed"""
+    order = np.argsort(-np.asarray(scores), kind='stable')
+    keep = []
+    while len(order):
+        best, order = order[0], order[1:]
+        keep.append(int(best))
+        order = order[box_iou(boxes[best], boxes[order]) <= iou_threshold]
+    return keep
+
+def detect_signs(image, filename='image', classifier='images', max_size=None, iou_threshold=0.3,
+                 fallback=True):
+    """Every plausible sign of an image, as common.Records with a box
+    
+    The contour scoring runs only inside the color proposals. With fallback the
+    whole image is classified when there is no proposal (e.g. a cropped sign).
+    """
+    regions = propose_regions(image)
+    if not len(regions) and fallback:
+        regions = np.array([[0, 0, image.shape[1], image.shape[0]]])
+    records = []
+    for x0, y0, x1, y1 in regions:
+        crop = image[y0:y1, x0:x1]
+        record = classify_record(crop, filename, classifier, context.ImageContext(crop, max_size=max_size))
+        if record.ctr is None or record.score <= 0:
+            continue
+        ctr = record.ctr + np.array([x0, y0], dtype=np.int32)
+        x, y, w, h = cv2.boundingRect(ctr)
+        records.append(record._replace(ctr=ctr, box=(x, y, x + w, y + h)))
+    if not records:
+        return []
+    boxes = np.array([record.box for record in records])
+    return [records[i] for i in non_max_suppression(boxes, [r.score for r in records], iou_threshold)]
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Detect every traffic sign of the images')
+    parser.add_argument('input', help='folder of the images (class folders included)')
+    parser.add_argument('--classifier', choices=CLASSIFIERS, default='images')
+    parser.add_argument('--max-size', type=int, help='downscale the regions to this larger side')
+    parser.add_argument('--iou', type=float, default=0.3, help='IoU above which boxes are suppressed')
+    parser.add_argument('--no-fallback', action='store_true',
+                        help='no detection when there is no color proposal')
+    return parser.parse_args()
+
+def main():
+    """Print one JSON line per image with its detections"""
+    args = parse_args()
+    for path in list_images(args.input):
+        image = cv2.imread(path)
+        if image is None:
+            print(f"Image Couldn't Read: {path}", file=sys.stderr)
+            continue
+        detections = detect_signs(image, path, args.classifier, args.max_size, args.iou,
+                                  not args.no_fallback)
+        sys.stdout.write(json.dumps({'filename': path,
+                                     'detections': [record.to_dict() for record in detections]}) + '\n')
+
+if __name__ == "__main__":
+    main()
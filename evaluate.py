@@ -0,0 +1,174 @@
+import os
+import sys
+import json
+import time
+import argparse
+import cv2
+import numpy as np
+from functools import partial
+from multiprocessing import Pool
+
+import context
+from annotations import ANNOTATION_FILE, CANVAS, AnnotationStore
+from common import CLASSIFIERS, list_images
+from parallel import classify_record
+
+# Size (width, height) of the groundTruth.py canvas the polygons are drawn on
+ANNOTATION_CANVAS = CANVAS
+# groundTruth.classify_shape types -> shape names of the classifiers
+TYPE_SHAPES = {
+    'Triangular': 'triangle',
+    'Rectangular': 'rectangle',
+    'Pentagonal': 'pentagon',
+    'Octagonal': 'octagon',
+    'Circle': 'circle',
+    'Unknown': 'unknown',
+    '6-sided Polygon': 'hexagon',
+    '7-sided Polygon': 'heptagon',
+}
+
+def normalize_shape(shape):
+    """Classifiers disagree on case ('Triangle' / 'triangle'), compare in lower case"""
+    return TYPE_SHAPES.get(shape, shape).lower()
+
+def parse_coordinates(coordinates):
+    """'[x, y], [x, y], ...' string (or list) of ground_truth.json as an (n, 2) array"""
+    if isinstance(coordinates, str):
+        coordinates = json.loads(f'[{coordinates}]')
+    return np.asarray(coordinates, dtype=np.float64).reshape(-1, 2)
+
+def load_ground_truth(json_file=ANNOTATION_FILE):
+    """{filename: (shape, polygon)}, polygon is on the annotation canvas
+
+    json_file: a ground_truth.json dict or an annotations.AnnotationStore (.jsonl)
+    """
+    if json_file.endswith('.jsonl'):
+        ground_truth = {}
+        for filename, label in AnnotationStore(json_file).items():
+            # drawn on another canvas size, rescaled to ANNOTATION_CANVAS
+            scale = np.divide(ANNOTATION_CANVAS, label['canvas'])
+            ground_truth[filename] = (normalize_shape(label['type']),
+                                      parse_coordinates(label['coordinates']) * scale)
+        return ground_truth
+    with open(json_file) as f:
+        data = json.load(f)
+    return {filename: (normalize_shape(label['type']), parse_coordinates(label['coordinates']))
+            for filename, label in data.items()}
+
+def polygon_iou(polygon_a, polygon_b):
+    """IoU of two (n, 2) polygons, rasterized only over their common bounding box"""
+    points = np.concatenate([polygon_a, polygon_b])
+    x0, y0 = np.floor(points.min(axis=0)).astype(int)
+    x1, y1 = np.ceil(points.max(axis=0)).astype(int) + 1
+    masks = np.zeros((2, y1 - y0, x1 - x0), dtype=np.uint8)
+    for mask, polygon in zip(masks, (polygon_a, polygon_b)):
+        cv2.fillPoly(mask, [np.round(polygon - (x0, y0)).astype(np.int32)], 1)
+    union = np.count_nonzero(masks.any(axis=0))
+    return np.count_nonzero(masks.all(axis=0)) / union if union else 0.0
+
+def evaluate_file(item, classifier='images', max_size=None):
+    """Worker: classify one labeled image, returns (filename, truth, predicted, iou, seconds)"""
+    image_path, (truth, polygon) = item
+    filename = os.path.basename(image_path)
+    image = cv2.imread(image_path)
+    if image is None:
+        return filename, truth, 'not found', 0.0, 0.0
+    start = time.perf_counter()
+    record = classify_record(image, filename, classifier,
+                             context.ImageContext(image, max_size=max_size))
+    seconds = time.perf_counter() - start
+    iou = 0.0
+    if record.ctr is not None and len(record.ctr) > 2:
+        height, width = image.shape[:2]
+        # rescale the annotation from the canvas to the image
+        scale = (width / ANNOTATION_CANVAS[0], height / ANNOTATION_CANVAS[1])
+        iou = polygon_iou(record.ctr.reshape(-1, 2), polygon * scale)
+    return filename, truth, normalize_shape(record.shape), iou, seconds
+
+def confusion_matrix(truths, predictions):
+    """(labels, matrix), matrix[i, j] counts label i annotated and label j predicted"""
+    labels = sorted(set(truths) | set(predictions))
+    index = {label: i for i, label in enumerate(labels)}
+    matrix = np.zeros((len(labels), len(labels)), dtype=int)
+    np.add.at(matrix, ([index[t] for t in truths], [index[p] for p in predictions]), 1)
+    return labels, matrix
+
+def evaluate(items, classifier='images', workers=None, max_size=None):
+    """Evaluate a classifier on (image_path, (shape, polygon)) items
+    
+    workers: number of processes, None uses every core and 1 runs in this process
+    max_size: downscale every image to this larger side before thresholding
+    """
+    worker = partial(evaluate_file, classifier=classifier, max_size=max_size)
+    workers = workers or os.cpu_count()
+    start = time.perf_counter()
+    if workers == 1:
+        rows = [worker(item) for item in items]
+    else:
+        with Pool(workers) as pool:
+            rows = pool.map(worker, items, chunksize=max(1, len(items) // (4 * workers)))
+    wall = time.perf_counter() - start
+
+    filenames, truths, predictions, ious, seconds = zip(*rows)
+    labels, matrix = confusion_matrix(truths, predictions)
+    ious = np.array(ious)
+    return {
+        'classifier': classifier,
+        'images': len(rows),
+        'accuracy': float(np.trace(matrix) / len(rows)),
+        'mean_iou': float(ious.mean()),
+        'median_iou': float(np.median(ious)),
+        'images_per_s': len(rows) / wall,
+        'classify_ms': float(np.mean(seconds) * 1000),
+        'labels': labels,
+        'confusion': matrix.tolist(),
+        'per_image': {f: {'truth': t, 'predicted': p, 'iou': float(i)}
+                      for f, t, p, i in zip(filenames, truths, predictions, ious)},
+    }
+
+def print_confusion(labels, matrix):
+    """Annotated labels in rows, predicted labels in columns"""
+    width = max(len(label) for label in labels) + 2
+    print(' ' * width + ''.join(label[:width - 1].rjust(width) for label in labels))
+    for label, row in zip(labels, matrix):
+        print(label.ljust(width) + ''.join(str(count).rjust(width) for count in row))
+
+def labeled_items(ground_truth, input_folder):
+    """Pair the labeled filenames with their paths under input_folder"""
+    paths = {os.path.basename(path): path for path in list_images(input_folder)}
+    missing = [filename for filename in ground_truth if filename not in paths]
+    if missing:
+        print(f'{len(missing)} labeled images not found under {input_folder}', file=sys.stderr)
+    return [(paths[filename], label) for filename, label in sorted(ground_truth.items())
+            if filename in paths]
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Accuracy and throughput against the ground truth annotations')
+    parser.add_argument('--ground-truth', default=ANNOTATION_FILE,
+                        help='annotation store of groundTruth.py, or an old ground_truth.json')
+    parser.add_argument('--input', default='traffic_Data', help='folder searched for the labeled images')
+    parser.add_argument('--classifier', nargs='+', default=list(CLASSIFIERS),
+                        choices=CLASSIFIERS)
+    parser.add_argument('--workers', type=int, default=0, help='number of processes, 0 uses every core')
+    parser.add_argument('--max-size', type=int, help='downscale the images to this larger side')
+    parser.add_argument('--output', help='JSON file of the full report')
+    return parser.parse_args()
+
+def main():
+    args = parse_args()
+    items = labeled_items(load_ground_truth(args.ground_truth), args.input)
+    if not items:
+        sys.exit('No labeled image found')
+    reports = []
+    for classifier in args.classifier:
+        report = evaluate(items, classifier, args.workers, args.max_size)
+        print(f"\n{classifier}: accuracy {report['accuracy']:.3f}, mean IoU {report['mean_iou']:.3f}, "
+              f"{report['images_per_s']:.1f} images/s ({report['classify_ms']:.2f} ms/image)")
+        print_confusion(report['labels'], np.array(report['confusion']))
+        reports.append(report)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(reports, f, indent=4)
+
+if __name__ == "__main__":
+    main()
@@ -1,66 +1,12 @@
 import tkinter as tk
 from PIL import Image, ImageTk
 import os
-import json
-
-json_file = "ground_truth.json"
-data = {}
-with open(json_file, "w") as f:
-    json.dump(data, f, indent=4)
-
-coordinates = []
-line_ids = []
-image_name = None
-
-def on_click(event):
-    """Save coordinates, dynamically update edges."""
-    global coordinates, line_ids
-    x, y = event.x, event.y
-    coordinates.append([x, y])
-    
-    canvas.create_oval(x-5, y-5, x+5, y+5, fill="red", outline="black")
-
-    for line_id in line_ids:
-        canvas.delete(line_id)
-    line_ids = []
-
-    for i in range(len(coordinates) - 1):
-        line_id = canvas.create_line(
-            coordinates[i][0], coordinates[i][1],
-            coordinates[i + 1][0], coordinates[i + 1][1],
-            fill="blue", width=3
-        )
-        line_ids.append(line_id)
-    
-
-    if len(coordinates) > 2:
-        line_id = canvas.create_line(
-            coordinates[-1][0], coordinates[-1][1],
-            coordinates[0][0], coordinates[0][1],
-            fill="blue", width=2
-        )
-        line_ids.append(line_id)
-    
-    print(f"Coordinates: ({x}, {y})")
-
-
-def on_key(event):
-    """Write JSON and load next image on 'Enter' key."""
-    global coordinates, image_name
-    if event.keysym == "Return":
-        if len(coordinates) > 2:
-            shape_type = classify_shape(len(coordinates))
-            formatted_coords = ", ".join([f"[{x}, {y}]" for x, y in coordinates])
-            data[image_name] = {
-                "type": shape_type,
-                "coordinates": formatted_coords
-            }
-            with open(json_file, "w") as f:
-                json.dump(data, f, indent=4)
-            print(f"{image_name}: {shape_type}, {formatted_coords}")
-        coordinates = []
-        canvas.delete("all")
-        load_next_image()
+import argparse
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+from annotations import ANNOTATION_FILE, CANVAS, AnnotationStore
+from common import list_images
 
 def classify_shape(corner_count):
     """Detect shape from corner numbers."""
@@ -71,40 +17,129 @@ def classify_shape(corner_count):
         return "Unknown"
     return shapes.get(corner_count, f"{corner_count}-sided Polygon")
 
-def load_next_image():
-    """Load next image."""
-    global image_name, coordinates
-    if image_files:
-        image_name = image_files.pop(0)
-        img_path = os.path.join(folder_path, image_name)
-        
-        img = Image.open(img_path)
-        img = img.resize((800, 600))
-        tk_img = ImageTk.PhotoImage(img)
-        
-        canvas.image = tk_img
-        canvas.create_image(0, 0, anchor=tk.NW, image=tk_img)
-        print(f"Uploaded image: {image_name}")
-    else:
-        print("All images done.")
-        root.destroy()
+def load_image(img_path):
+    """Worker: the image resized to the canvas and its original size"""
+    img = Image.open(img_path)
+    return img.resize(CANVAS), img.size
 
-folder_path = "traffic_Data/Data/mix"
+class Annotator:
+    """Canvas of the polygon annotation, one image after the other
 
-if os.path.exists(folder_path):
-    image_files = [f for f in os.listdir(folder_path) if f.endswith(('.png', '.jpg', '.jpeg'))]
-    if not image_files:
-        print("No image found in folder!")
-    else:
-        root = tk.Tk()
-        canvas = tk.Canvas(root, width=800, height=600)
-        canvas.pack()
+    Click the corners, Enter saves the polygon (at least 3 corners) and loads the next image.
+    The next prefetch images are read and resized in background threads meanwhile.
+    """
+    def __init__(self, root, image_paths, store, prefetch=4):
+        self.root = root
+        self.store = store
+        self.paths = deque(image_paths)
+        self.prefetch = prefetch
+        self.executor = ThreadPoolExecutor(2)
+        self.pending = deque()
+        self.coordinates = []
+        self.line_ids = []
+        self.image_name = None
+        self.image_size = None
+
+        self.canvas = tk.Canvas(root, width=CANVAS[0], height=CANVAS[1])
+        self.canvas.pack()
+        self.canvas.bind("<Button-1>", self.on_click)
+        root.bind("<Key>", self.on_key)
+
+    def on_click(self, event):
+        """Save coordinates, dynamically update edges."""
+        x, y = event.x, event.y
+        self.coordinates.append([x, y])
+
+        self.canvas.create_oval(x-5, y-5, x+5, y+5, fill="red", outline="black")
+
+        for line_id in self.line_ids:
+            self.canvas.delete(line_id)
+        self.line_ids = []
+
+        for i in range(len(self.coordinates) - 1):
+            line_id = self.canvas.create_line(
+                self.coordinates[i][0], self.coordinates[i][1],
+                self.coordinates[i + 1][0], self.coordinates[i + 1][1],
+                fill="blue", width=3
+            )
+            self.line_ids.append(line_id)
 
-        canvas.bind("<Button-1>", on_click)
-        root.bind("<Key>", on_key)
+        if len(self.coordinates) > 2:
+            line_id = self.canvas.create_line(
+                self.coordinates[-1][0], self.coordinates[-1][1],
+                self.coordinates[0][0], self.coordinates[0][1],
+                fill="blue", width=2
+            )
+            self.line_ids.append(line_id)
 
-        load_next_image()
+        print(f"Coordinates: ({x}, {y})")
 
+    def on_key(self, event):
+        """Append the annotation and load next image on 'Enter' key."""
+        if event.keysym == "Return":
+            if len(self.coordinates) > 2:
+                shape_type = classify_shape(len(self.coordinates))
+                self.store.add(self.image_name, shape_type, self.coordinates, self.image_size)
+                print(f"{self.image_name}: {shape_type}, {self.coordinates}")
+            self.coordinates = []
+            self.line_ids = []
+            self.canvas.delete("all")
+            self.load_next_image()
+
+    def fill(self):
+        """Keep the next prefetch images loading in the background"""
+        while len(self.pending) < self.prefetch and self.paths:
+            img_path = self.paths.popleft()
+            self.pending.append((img_path, self.executor.submit(load_image, img_path)))
+
+    def load_next_image(self):
+        """Load next image."""
+        self.fill()
+        while self.pending:
+            img_path, future = self.pending.popleft()
+            self.fill()
+            try:
+                img, self.image_size = future.result()
+            except OSError as e:
+                print(f"Image Couldn't Read: {img_path} ({e})")
+                continue
+            self.image_name = os.path.basename(img_path)
+            # PhotoImage must be created in the tkinter thread
+            tk_img = ImageTk.PhotoImage(img)
+            self.canvas.image = tk_img
+            self.canvas.create_image(0, 0, anchor=tk.NW, image=tk_img)
+            print(f"Uploaded image: {self.image_name}")
+            return
+        print("All images done.")
+        self.root.destroy()
+
+    def close(self):
+        self.executor.shutdown(cancel_futures=True)
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Annotate the sign polygons of a folder of images')
+    parser.add_argument('--input', default='traffic_Data/Data/mix', help='folder of the images, class folders included')
+    parser.add_argument('--output', default=ANNOTATION_FILE,
+                        help='annotation store, the images it already has are skipped')
+    parser.add_argument('--prefetch', type=int, default=4, help='images loaded ahead')
+    return parser.parse_args()
+
+def main():
+    args = parse_args()
+    if not os.path.exists(args.input):
+        print(f"No folder found: {args.input}")
+        return
+    with AnnotationStore(args.output) as store:
+        image_paths = [path for path in list_images(args.input) if os.path.basename(path) not in store]
+        if not image_paths:
+            print("No image left to annotate in folder!")
+            return
+        print(f"{len(image_paths)} images to annotate, {len(store)} already in {args.output}")
+        root = tk.Tk()
+        annotator = Annotator(root, image_paths, store, args.prefetch)
+        annotator.load_next_image()
         root.mainloop()
-else:
-    print(f"No folder found: {folder_path}")
+        annotator.close()
+
+if __name__ == "__main__":
+    main()
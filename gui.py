@@ -0,0 +1,48 @@
+import os
+import cv2
+from matplotlib import pyplot as plt
+
+# The matplotlib panels of the classifiers. Only imported when panels are drawn, the
+# detection core (common, context, scoring, pipeline) never loads matplotlib or tkinter.
+
+# Figure size of the debug panels saved in headless mode (no screen to measure)
+DEBUG_FIGSIZE = (16, 9)
+
+def init_gui(filename,image,blurred,gray,figsize=None):
+    if figsize is None:
+        # Get the screen size, tkinter is only needed here
+        import detect_screen_size
+        figsize = detect_screen_size.detect_screen_size()
+    weight, height = figsize
+    # To visualize the results
+    plt.figure(figsize=(weight, height))
+    # Original image
+    plt.subplot(3, 4, 1)
+    plt.title(f'1. Original Image {filename}')
+    plt.imshow(cv2.cvtColor(image, cv2.COLOR_BGR2RGB))
+    plt.axis('off')
+    # Grayscale
+    plt.subplot(3, 4, 2)
+    plt.title('2. Grayscale')
+    plt.imshow(gray, cmap='gray')
+    plt.axis('off')
+    # Blurred
+    plt.subplot(3, 4, 3)
+    plt.title('3. Gaussian Blurred')
+    plt.imshow(blurred, cmap='gray')
+    plt.axis('off')
+
+def finish_gui(filename, debug_folder=None):
+    """Show the current figure, or save it to debug_folder in headless mode"""
+    if debug_folder is None:
+        plt.show()
+        return
+    path = os.path.join(debug_folder, os.path.splitext(filename)[0] + '.png')
+    # packed images are named by their path in the packed folder
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    plt.savefig(path)
+    plt.close()
+
+def use_headless():
+    """No window can be opened, render the figures off-screen"""
+    plt.switch_backend('Agg')
@@ -0,0 +1,101 @@
+import os
+import json
+import time
+import threading
+import cProfile
+from contextlib import contextmanager
+
+# The Tracer of this process, None while tracing is disabled. The stages check it
+# once per call, so a disabled run pays a single attribute test per stage.
+active = None
+
+class Tracer:
+    """Spans and counters of the pipeline stages of one process
+
+    Events use the Chrome trace event format (chrome://tracing, Perfetto):
+    spans are complete events ('X') and counters are 'C' events, times in microseconds.
+    """
+    def __init__(self):
+        self.origin = time.perf_counter()
+        self.pid = os.getpid()
+        self.events = []
+
+    def add_span(self, name, start, seconds, category='stage', **args):
+        """Record a span that started at perf_counter() start and lasted seconds"""
+        # list.append is atomic, the prefetch threads record their decode spans here too
+        self.events.append({'name': name, 'cat': category, 'ph': 'X',
+                            'ts': (start - self.origin) * 1e6, 'dur': seconds * 1e6,
+                            'pid': self.pid, 'tid': threading.get_ident(), 'args': args})
+
+    @contextmanager
+    def span(self, name, category='stage', **args):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add_span(name, start, time.perf_counter() - start, category, **args)
+
+    def count(self, name, **values):
+        """Record counter values (numbers) at the current time"""
+        self.events.append({'name': name, 'ph': 'C', 'ts': (time.perf_counter() - self.origin) * 1e6,
+                            'pid': self.pid, 'tid': threading.get_ident(), 'args': values})
+
+    def summary(self):
+        """{span name: {'count', 'total_ms', 'mean_ms'}} and {counter name: summed values}"""
+        spans, counters = {}, {}
+        for event in self.events:
+            if event['ph'] == 'X':
+                stats = spans.setdefault(event['name'], {'count': 0, 'total_ms': 0.0})
+                stats['count'] += 1
+                stats['total_ms'] += event['dur'] / 1000
+            else:
+                totals = counters.setdefault(event['name'], {})
+                for key, value in event['args'].items():
+                    totals[key] = totals.get(key, 0) + value
+        for stats in spans.values():
+            stats['mean_ms'] = stats['total_ms'] / stats['count']
+        return spans, counters
+
+    def save(self, path):
+        """Write the events, as JSON lines if path ends with .jsonl, else as a Chrome trace"""
+        with open(path, 'w') as f:
+            if path.endswith('.jsonl'):
+                for event in self.events:
+                    f.write(json.dumps(event) + '\n')
+            else:
+                json.dump({'traceEvents': self.events, 'displayTimeUnit': 'ms'}, f)
+
+def enable():
+    """Start tracing in this process and return its Tracer"""
+    global active
+    active = Tracer()
+    return active
+
+def disable():
+    """Stop tracing, returns the Tracer that was active"""
+    global active
+    tracer, active = active, None
+    return tracer
+
+@contextmanager
+def span(name, category='stage', **args):
+    """Span of the active Tracer, nothing is recorded while tracing is disabled"""
+    if active is None:
+        yield
+        return
+    with active.span(name, category, **args):
+        yield
+
+@contextmanager
+def profile(path=None):
+    """cProfile the block and dump the statistics to path (pstats format), None does nothing"""
+    if path is None:
+        yield
+        return
+    profiler = cProfile.Profile()
+    profiler.enable()
+    try:
+        yield
+    finally:
+        profiler.disable()
+        profiler.dump_stats(path)
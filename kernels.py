@@ -0,0 +1,113 @@
+import math
+import time
+import threading
+import cv2
+import numpy as np
+
+# adaptiveThreshold filters the block of every pixel with replicated borders
+BORDER = cv2.BORDER_REPLICATE | cv2.BORDER_ISOLATED
+
+class KernelBank:
+    """Reusable image buffers of one thread and the fused threshold stage
+
+    A buffer is kept by name and only grows when a larger image arrives, so a worker
+    classifying images of similar sizes stops allocating after the first ones.
+    The arrays it returns are overwritten by the next image using the same names.
+    """
+    def __init__(self):
+        self.arrays = {}
+
+    def buffer(self, name, shape, dtype=np.uint8):
+        """Contiguous array of shape for name, a view of its grown storage"""
+        size = math.prod(shape)
+        array = self.arrays.get((name, dtype))
+        if array is None or array.size < size:
+            array = self.arrays[(name, dtype)] = np.empty(size, dtype=dtype)
+        return array[:size].reshape(shape)
+
+    def local_mean(self, blurred, kind, block_size):
+        """uint8 local mean of one adaptive threshold kind, computed as adaptiveThreshold does"""
+        mean = self.buffer(('mean', kind, block_size), blurred.shape)
+        if kind == 'adaptive_mean':
+            return cv2.boxFilter(blurred, -1, (block_size, block_size), dst=mean,
+                                 normalize=True, borderType=BORDER)
+        # the Gaussian one is filtered in float32 and rounded back
+        src = self.buffer('float', blurred.shape, np.float32)
+        np.copyto(src, blurred)
+        smooth = cv2.GaussianBlur(src, (block_size, block_size), 0, sigmaY=0, borderType=BORDER,
+                                  dst=self.buffer('smooth', blurred.shape, np.float32))
+        return cv2.convertScaleAbs(smooth, dst=mean)
+
+    def thresholds(self, blurred, methods, dsts, timed=None):
+        """All threshold methods of one blurred image, from shared intermediate results
+
+        methods: context.THRESHOLDS tuples, dsts: the output buffer of every method.
+        Otsu computes its histogram once for otsu and otsu_inv (one is the negation
+        of the other), the adaptive thresholds compute one local mean per (kind, block
+        size) and one signed difference to it for all their C values. The outputs are
+        those of cv2.threshold / cv2.adaptiveThreshold. Returns {method: image}.
+        timed: optional function (kind, start) called once the methods of a kind ran since
+        start (perf_counter), so every kind is timed on its own as the inline stages are
+        """
+        if timed is None:
+            timed = lambda kind, start: None
+        results = {}
+        otsu = [method for method in methods if method[0] in ('otsu', 'otsu_inv')]
+        if otsu:
+            start = time.perf_counter()
+            first = otsu[0]
+            flag = cv2.THRESH_BINARY if first[0] == 'otsu' else cv2.THRESH_BINARY_INV
+            results[first] = cv2.threshold(blurred, 0, 255, flag + cv2.THRESH_OTSU, dst=dsts[first])[1]
+            timed(first[0], start)
+            for method in otsu[1:]:
+                start = time.perf_counter()
+                results[method] = results[first] if method[0] == first[0] else \
+                    cv2.bitwise_not(results[first], dst=dsts[method])
+                timed(method[0], start)
+
+        blocks = {}
+        for method in methods:
+            if method[0] in ('adaptive_gaussian', 'adaptive_mean'):
+                kind, block_size, c = method
+                blocks.setdefault((kind, block_size), []).append(method)
+        for (kind, block_size), block_methods in blocks.items():
+            start = time.perf_counter()
+            if len(block_methods) == 1:
+                # nothing to share, adaptiveThreshold filters and compares in one pass
+                kind, block_size, c = method = block_methods[0]
+                flag = cv2.ADAPTIVE_THRESH_GAUSSIAN_C if kind == 'adaptive_gaussian' else cv2.ADAPTIVE_THRESH_MEAN_C
+                results[method] = cv2.adaptiveThreshold(blurred, 255, flag, cv2.THRESH_BINARY_INV,
+                                                        block_size, c, dst=dsts[method])
+                timed(kind, start)
+                continue
+            mean = self.local_mean(blurred, kind, block_size)
+            # THRESH_BINARY_INV: 255 where mean - src >= floor(C), as adaptiveThreshold
+            deltas = {method: math.floor(method[2]) for method in block_methods}
+            if min(deltas.values()) >= 1:
+                # the differences saturated at 0 compare the same to positive deltas
+                diff = cv2.subtract(mean, blurred, dst=self.buffer('diff', blurred.shape))
+            else:
+                diff = cv2.subtract(mean, blurred, dst=self.buffer('diff', blurred.shape, np.int16),
+                                    dtype=cv2.CV_16S)
+            for method, delta in deltas.items():
+                results[method] = cv2.compare(diff, delta, cv2.CMP_GE, dst=dsts[method])
+            timed(kind, start)
+
+        for method in methods:
+            start = time.perf_counter()
+            if method[0] == 'canny':
+                results[method] = cv2.Canny(blurred, *method[1:], edges=dsts[method])
+            elif method[0] == 'none':
+                results[method] = blurred
+            else:
+                continue
+            timed(method[0], start)
+        return results
+
+local = threading.local()
+
+def local_bank():
+    """The KernelBank of the calling thread"""
+    if not hasattr(local, 'bank'):
+        local.bank = KernelBank()
+    return local.bank
@@ -0,0 +1,128 @@
+import os
+import sys
+import json
+import time
+import argparse
+import threading
+import http.client
+import numpy as np
+from collections import Counter
+from urllib.parse import urlencode
+
+from common import list_images
+
+def request(connection, path, method='GET', body=None):
+    """(status, JSON body) of one request on a kept-alive connection"""
+    connection.request(method, path, body)
+    response = connection.getresponse()
+    return response.status, json.loads(response.read())
+
+def replay(images, host='127.0.0.1', port=8080, classifier='images', concurrency=8, duration=10,
+           backoff=0.01):
+    """Closed-loop load: concurrency clients post images in turn for duration seconds
+
+    images: (filename, encoded bytes) replayed in order, from the start again once sent
+    backoff: seconds a client waits after a rejected (503) or failed request, doubled
+    after every consecutive one up to a second
+    Returns the load summary and the service metrics at the end.
+    """
+    lock = threading.Lock()
+    sent = [0]
+    latencies, statuses, shapes = [], Counter(), Counter()
+    stop = time.perf_counter() + duration
+
+    def client():
+        connection = http.client.HTTPConnection(host, port)
+        delay = backoff
+        while time.perf_counter() < stop:
+            with lock:
+                filename, data = images[sent[0] % len(images)]
+                sent[0] += 1
+            path = '/classify?' + urlencode({'classifier': classifier, 'filename': filename})
+            start = time.perf_counter()
+            try:
+                status, body = request(connection, path, 'POST', data)
+            except (OSError, http.client.HTTPException):
+                # a reset connection is counted and opened again
+                status, body = 'connection error', None
+                connection.close()
+                connection = http.client.HTTPConnection(host, port)
+            latency = time.perf_counter() - start
+            with lock:
+                statuses[status] += 1
+                if status == 200:
+                    latencies.append(latency)
+                    shapes[body['shape']] += 1
+            if status == 200:
+                delay = backoff
+            else:
+                time.sleep(delay)
+                delay = min(2 * delay, 1.0)
+        connection.close()
+
+    start = time.perf_counter()
+    threads = [threading.Thread(target=client) for _ in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+
+    latencies_ms = np.array(latencies) * 1000
+    summary = {
+        'classifier': classifier,
+        'concurrency': concurrency,
+        'duration_s': elapsed,
+        'requests': sum(statuses.values()),
+        'statuses': {str(status): count for status, count in statuses.items()},
+        'qps': len(latencies) / elapsed,
+        'latency_ms': None,
+        'shapes': dict(shapes),
+    }
+    if len(latencies_ms):
+        summary['latency_ms'] = {
+            'mean': float(latencies_ms.mean()),
+            'p50': float(np.percentile(latencies_ms, 50)),
+            'p95': float(np.percentile(latencies_ms, 95)),
+            'p99': float(np.percentile(latencies_ms, 99)),
+        }
+    connection = http.client.HTTPConnection(host, port)
+    _, summary['service'] = request(connection, '/metrics')
+    connection.close()
+    return summary
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Replay images against the service.py shape detection service')
+    parser.add_argument('--input', default='traffic_Data/TEST', help='folder of the replayed images')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument('--classifier', default='images')
+    parser.add_argument('--concurrency', type=int, nargs='+', default=[8],
+                        help='concurrent clients, one run per value')
+    parser.add_argument('--duration', type=float, default=10, help='seconds of every run')
+    parser.add_argument('--output', help='JSON file of the runs')
+    return parser.parse_args()
+
+def main():
+    args = parse_args()
+    images = []
+    for path in list_images(args.input):
+        with open(path, 'rb') as f:
+            images.append((os.path.basename(path), f.read()))
+    if not images:
+        sys.exit('No image found')
+
+    runs = []
+    for concurrency in args.concurrency:
+        run = replay(images, args.host, args.port, args.classifier, concurrency, args.duration)
+        latency = run['latency_ms'] or {'p50': 0, 'p99': 0}
+        print(f"{concurrency} clients: {run['qps']:.1f} QPS, p50 {latency['p50']:.1f} ms, "
+              f"p99 {latency['p99']:.1f} ms, statuses {run['statuses']}, "
+              f"mean batch {run['service']['mean_batch']:.2f}", file=sys.stderr)
+        runs.append(run)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(runs, f, indent=4)
+
+if __name__ == "__main__":
+    main()
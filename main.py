@@ -1,7 +1,28 @@
 import os
 import platform
 import shutil
-from classifyimages import classifyImages
+import argparse
+import json
+import sys
+from classifyimages import classifyByTemplate, classifyImages
+from classifyLargest import classifyByLargest
+from classifyQuality import classifyByQuality
+from cascade import classifyByCascade
+from output import MANIFEST_FORMATS, MODES, OutputWriter
+from parallel import classifyParallel, output_of
+from pipeline import THRESHOLD_MODES
+from stream import iterClassify
+from cache import ResultCache
+from store import ResultStore
+import instrument
+
+CLASSIFIERS = {
+    'images': classifyImages,
+    'largest': classifyByLargest,
+    'quality': classifyByQuality,
+    'cascade': classifyByCascade,
+    'template': classifyByTemplate,
+}
 
 def clean_output_folder(output_folder):
     """To remove previous classification outputs"""
@@ -10,13 +31,123 @@ def clean_output_folder(output_folder):
     os.makedirs(output_folder)
     return output_folder
 
+def parse_args():
+    parser = argparse.ArgumentParser(description='Traffic sign shape detection')
+    parser.add_argument('--input', help='folder of the images to classify, or a pack.py file')
+    parser.add_argument('--output', default='classified_symbols', help='folder of the classified images')
+    parser.add_argument('--classifier', choices=CLASSIFIERS, default='images',
+                        help='images: best quality Result, largest: largest area, quality: quality score, '
+                             'cascade: images with the early exit cascade of cascade.json, '
+                             'template: images with the nearest shape template of shapes.py')
+    parser.add_argument('--headless', action='store_true',
+                        help='run only the OpenCV stages, no matplotlib figures or tkinter')
+    parser.add_argument('--debug-sample', type=int, default=0, metavar='N',
+                        help='in headless mode save the debug panels of every N-th image')
+    parser.add_argument('--max-size', type=int, metavar='N',
+                        help='downscale every image to this larger side before thresholding')
+    parser.add_argument('--thresholds', choices=THRESHOLD_MODES,
+                        help='fused: all threshold methods of an image in one pass into reusable buffers '
+                             '(the default, same results), inline: every method on its own')
+    parser.add_argument('--grayscale', action='store_true',
+                        help='decode the images directly in grayscale (largest and quality only, '
+                             'may differ from the color decode by one gray level)')
+    parser.add_argument('--cache', metavar='FILE',
+                        help='result cache (SQLite), unchanged images are not classified again '
+                             '(with --workers or --jsonl)')
+    parser.add_argument('--cache-size', type=int, default=256, metavar='MB',
+                        help='least recently used results are evicted above this size')
+    parser.add_argument('--workers', type=int, metavar='N',
+                        help='classify every image under --input (class folders included) '
+                             'headless on N processes, 0 uses every core')
+    parser.add_argument('--chunksize', type=int, default=16,
+                        help='number of images sent to a worker at once')
+    parser.add_argument('--jsonl', action='store_true',
+                        help='stream one JSON record per image to stdout instead of writing images')
+    parser.add_argument('--output-mode', choices=MODES,
+                        help='draw: annotated copies (images default), copy: input files (largest and '
+                             'quality default), hardlink / symlink: links to the inputs, manifest: no images')
+    parser.add_argument('--manifest', choices=MANIFEST_FORMATS,
+                        help='also write manifest.csv or manifest.jsonl (with the contours, see output.py)')
+    parser.add_argument('--annotate-sample', type=int, default=0, metavar='N',
+                        help='draw mode annotates only about one image in N')
+    parser.add_argument('--image-format', choices=('.png', '.jpg'),
+                        help='encoding of the annotated images, the input format by default')
+    parser.add_argument('--jpeg-quality', type=int, default=95)
+    parser.add_argument('--png-compression', type=int, default=3, choices=range(10), metavar='0-9')
+    parser.add_argument('--writers', type=int, default=4, metavar='N',
+                        help='threads writing the outputs of a sequential run, 0 writes inline')
+    parser.add_argument('--trace', metavar='FILE',
+                        help='trace the stages into a Chrome trace (.json) or JSON lines (.jsonl) file')
+    parser.add_argument('--profile', metavar='FILE', help='cProfile the run into a pstats file')
+    parser.add_argument('--store', metavar='FILE',
+                        help='also save the results as a columnar .npz store (with --workers or --jsonl)')
+    return parser.parse_args()
+
 def main():
-    if platform.system() == 'Windows':
-        input_folder = 'traffic_Data\\DATA\\mix'
-    elif platform.system() == 'Linux':
-        input_folder = 'traffic_Data/DATA/mix/'
+    args = parse_args()
+    input_folder = args.input
+    if input_folder is None:
+        if platform.system() == 'Windows':
+            input_folder = 'traffic_Data\\DATA\\mix'
+        elif platform.system() == 'Linux':
+            input_folder = 'traffic_Data/DATA/mix/'
+
+    tracer = instrument.enable() if args.trace else None
+    if tracer is not None and args.workers not in (None, 1):
+        print('--trace records this process only, the worker processes are not traced', file=sys.stderr)
+    with instrument.profile(args.profile):
+        run(args, input_folder)
+    if tracer is not None:
+        tracer.save(args.trace)
+        spans, counters = tracer.summary()
+        for name, stats in sorted(spans.items(), key=lambda item: -item[1]['total_ms']):
+            print(f"{name}: {stats['count']} x {stats['mean_ms']:.3f} ms = {stats['total_ms']:.1f} ms",
+                  file=sys.stderr)
+        for name, totals in counters.items():
+            print(f'{name}: {totals}', file=sys.stderr)
+
+def make_writer(args, output_folder, workers):
+    """output.OutputWriter of the output options"""
+    mode = args.output_mode or output_of(args.classifier)
+    manifest = args.manifest or ('csv' if mode == 'manifest' else None)
+    return OutputWriter(output_folder, mode, manifest, args.annotate_sample, args.image_format,
+                        args.jpeg_quality, args.png_compression, workers)
+
+def run(args, input_folder):
+    """Classify input_folder as the options ask"""
+    cache = ResultCache(args.cache, args.cache_size * 2**20) if args.cache else None
+    store = ResultStore() if args.store else None
+    if args.jsonl:
+        for record in iterClassify(input_folder, args.classifier, args.max_size, cache, args.thresholds):
+            sys.stdout.write(json.dumps(record.to_dict()) + '\n')
+            if store is not None:
+                store.add(record)
+        if store is not None:
+            store.save(args.store)
+        return
+
+    if args.workers is not None:
+        output_folder = clean_output_folder(args.output)
+        records = classifyParallel(input_folder, output_folder, args.classifier,
+                                   workers=args.workers, chunksize=args.chunksize,
+                                   max_size=args.max_size, cache=cache,
+                                   writer=make_writer(args, output_folder, 0),
+                                   thresholds=args.thresholds)
+        if store is not None:
+            store.extend(records)
+            store.save(args.store)
+        return
 
-    classifyImages(input_folder, clean_output_folder('classified_symbols'))
+    options = {}
+    if args.grayscale:
+        if args.classifier not in ('largest', 'quality'):
+            sys.exit('--grayscale needs the color image for the output of this classifier')
+        options['grayscale'] = True
+    classify = CLASSIFIERS[args.classifier]
+    output_folder = clean_output_folder(args.output)
+    classify(input_folder, output_folder, headless=args.headless, debug_sample=args.debug_sample,
+             max_size=args.max_size, writer=make_writer(args, output_folder, args.writers),
+             thresholds=args.thresholds, **options)
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
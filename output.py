@@ -0,0 +1,197 @@
+import os
+import csv
+import sys
+import json
+import zlib
+import shutil
+import argparse
+import cv2
+import numpy as np
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+import common
+import instrument
+import kernels
+
+# How the classified images are written into their shape folders:
+# draw: a copy with the contour drawn, copy: the input file, hardlink / symlink: a link
+# to the input file, manifest: no image at all, only the manifest
+MODES = ('draw', 'copy', 'hardlink', 'symlink', 'manifest')
+MANIFEST_FORMATS = ('csv', 'jsonl')
+
+class OutputWriter:
+    """Writes the outputs of the classified images, in background threads
+
+    mode: one of MODES. Packed images have no file to copy or link, they are encoded.
+    manifest: 'csv' or 'jsonl' file of every Record written by finish, the JSON lines
+    keep the contours so annotated images can be rendered later (see render)
+    sample: draw mode annotates only the images whose filename hash is a multiple of
+    sample (the same images in every process), 0 annotates all of them
+    extension: encode the drawn images in this format (e.g. '.jpg') instead of the input one
+    jpeg_quality, png_compression: the cv2.imwrite encoding settings
+    workers: threads writing the images, 0 writes in the calling thread. A copy of
+    the writer sent to another process writes in its calling thread.
+    """
+    def __init__(self, output_folder, mode='draw', manifest=None, sample=0, extension=None,
+                 jpeg_quality=95, png_compression=3, workers=4, queue_size=32):
+        if mode not in MODES:
+            raise ValueError(f'Unknown output mode: {mode}')
+        self.output_folder = output_folder
+        self.mode = mode
+        self.manifest = manifest
+        self.sample = sample
+        self.extension = extension
+        # cv2.imwrite parameters by extension, the others are encoded with their defaults
+        self.params = {'.jpg': [cv2.IMWRITE_JPEG_QUALITY, jpeg_quality],
+                       '.jpeg': [cv2.IMWRITE_JPEG_QUALITY, jpeg_quality],
+                       '.png': [cv2.IMWRITE_PNG_COMPRESSION, png_compression]}
+        self.queue_size = queue_size
+        self.executor = ThreadPoolExecutor(workers) if workers else None
+        self.pending = deque()
+        self.errors = []
+
+    def __getstate__(self):
+        # threads can't be pickled, the copy in a worker process writes synchronously
+        state = self.__dict__.copy()
+        state.update(executor=None, pending=deque(), errors=[])
+        return state
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def annotated(self, filename):
+        return self.mode == 'draw' and (self.sample <= 0 or zlib.crc32(filename.encode()) % self.sample == 0)
+
+    def needs_image(self, record, image_path):
+        """Whether write needs the decoded image of a record (it may come from a cache)"""
+        if record.ctr is None or self.mode == 'manifest':
+            return False
+        if self.mode == 'draw':
+            return self.annotated(record.filename)
+        return image_path is None
+
+    def write(self, image, image_path, record):
+        """Write the output of one classified image into its shape folder
+
+        image_path is None for packed images, their array is encoded instead of copied.
+        Records without a contour (Not Found by a copy pipeline) are not written.
+        """
+        if record.ctr is None or self.mode == 'manifest':
+            return
+        if self.mode == 'draw' and not self.annotated(record.filename):
+            return
+        if self.executor is None:
+            self.write_now(image, image_path, record)
+            return
+        # at most queue_size images wait in memory for a thread
+        while len(self.pending) >= self.queue_size:
+            self.wait_one()
+        self.pending.append((record.filename, self.executor.submit(self.write_now, image, image_path, record)))
+
+    def write_now(self, image, image_path, record):
+        with instrument.span('write', 'io'):
+            self.save(image, image_path, record)
+
+    def save(self, image, image_path, record):
+        # record.filename is relative to the input folder, its class folders are kept
+        output_path = os.path.join(self.output_folder, record.shape, record.filename)
+        os.makedirs(os.path.dirname(output_path), exist_ok=True)
+        if self.mode == 'draw':
+            if self.extension:
+                output_path = os.path.splitext(output_path)[0] + self.extension
+            # drawn in a buffer of this thread, encoded before its next image
+            result_img = common.color_copy(image, kernels.local_bank().buffer('draw', image.shape[:2] + (3,)))
+            cv2.drawContours(result_img, record.ctr, -1, (0,255,0), 2)
+            self.encode(output_path, result_img)
+        elif image_path is None:
+            self.encode(output_path, image)
+        elif self.mode == 'copy':
+            shutil.copy(image_path, output_path)
+        else:
+            if os.path.lexists(output_path):
+                os.remove(output_path)
+            if self.mode == 'hardlink':
+                os.link(image_path, output_path)
+            else:
+                os.symlink(os.path.abspath(image_path), output_path)
+
+    def encode(self, output_path, image):
+        extension = os.path.splitext(output_path)[1].lower()
+        cv2.imwrite(output_path, image, self.params.get(extension, []))
+
+    def wait_one(self):
+        filename, future = self.pending.popleft()
+        try:
+            future.result()
+        except Exception as e:
+            self.errors.append((filename, f'{type(e).__name__}: {e}'))
+
+    def finish(self, records=()):
+        """Wait for the pending writes and write the manifest of records"""
+        while self.pending:
+            self.wait_one()
+        for filename, error in self.errors:
+            print(f"Couldn't Write {filename}: {error}")
+        if self.manifest:
+            write_manifest(os.path.join(self.output_folder, f'manifest.{self.manifest}'), records)
+
+    def close(self):
+        while self.pending:
+            self.wait_one()
+        if self.executor is not None:
+            self.executor.shutdown()
+
+def write_manifest(path, records):
+    """CSV (without the contours) or JSON lines manifest of records, by the extension of path"""
+    with open(path, 'w', newline='') as f:
+        if path.endswith('.jsonl'):
+            for record in records:
+                f.write(json.dumps(record.to_dict(), default=float) + '\n')
+            return
+        writer = csv.writer(f)
+        writer.writerow(['filename', 'shape', 'num_vertices', 'score', 'method', 'error'])
+        for record in records:
+            writer.writerow([record.filename, record.shape, record.num_vertices, record.score,
+                             record.method, record.error or ''])
+
+def render(manifest_path, input_folder, output_folder, filenames=None, extension=None):
+    """Draw the contours of a JSON lines manifest on their images, on request
+
+    input_folder: the input folder of the classification, the manifest filenames are
+    relative to it
+    filenames: only render these, None renders every image with a contour
+    """
+    paths = {common.image_name(path, input_folder): path for path in common.list_images(input_folder)}
+    writer = OutputWriter(output_folder, 'draw', extension=extension)
+    with writer, open(manifest_path) as f:
+        for line in f:
+            row = json.loads(line)
+            if row['ctr'] is None or (filenames and row['filename'] not in filenames):
+                continue
+            if row['filename'] not in paths:
+                print(f"Image not found: {row['filename']}", file=sys.stderr)
+                continue
+            ctr = np.array(row['ctr'], dtype=np.int32).reshape(-1, 1, 2)
+            record = common.Record(row['filename'], row['shape'], ctr=ctr)
+            writer.write(cv2.imread(paths[row['filename']]), paths[row['filename']], record)
+        writer.finish()
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Render the annotated images of a JSON lines manifest')
+    parser.add_argument('manifest', help='manifest.jsonl written with --manifest jsonl')
+    parser.add_argument('filenames', nargs='*', help='images to render, all of them if none is given')
+    parser.add_argument('--input', default='traffic_Data', help='input folder of the classification')
+    parser.add_argument('--output', default='annotated')
+    parser.add_argument('--extension', help='encode the images in this format, e.g. .jpg')
+    return parser.parse_args()
+
+def main():
+    args = parse_args()
+    render(args.manifest, args.input, args.output, set(args.filenames), args.extension)
+
+if __name__ == "__main__":
+    main()
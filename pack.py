@@ -0,0 +1,110 @@
+import os
+import re
+import sys
+import json
+import argparse
+import cv2
+import numpy as np
+
+from common import list_images
+
+MAGIC = b'TSPACK01'
+# every image starts on a multiple of ALIGN bytes
+ALIGN = 64
+
+def class_id(filename):
+    """Class of a traffic_Data image from its NNN_ prefix, -1 if it has none"""
+    match = re.match(r'(\d+)_', filename)
+    return int(match.group(1)) if match else -1
+
+def is_pack(path):
+    return os.path.isfile(path) and path.endswith('.pack')
+
+def pack_folder(input_folder, pack_path, grayscale=False):
+    """Pack every image under input_folder into one file of decoded uint8 arrays
+    
+    Layout: MAGIC, the images (aligned to ALIGN bytes), a JSON index with the name,
+    class ID, offset and shape of every image, and the offset of the index (uint64).
+    grayscale: store cv2.cvtColor(BGR2GRAY) images, the same as the pipeline computes
+    """
+    names, class_ids, offsets, shapes = [], [], [], []
+    with open(pack_path, 'wb') as f:
+        f.write(MAGIC)
+        for path in list_images(input_folder):
+            image = cv2.imread(path)
+            if image is None:
+                print(f"Image Couldn't Read: {path}")
+                continue
+            if grayscale:
+                image = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+            f.write(b'\0' * (-f.tell() % ALIGN))
+            names.append(os.path.relpath(path, input_folder).replace(os.sep, '/'))
+            class_ids.append(class_id(os.path.basename(path)))
+            offsets.append(f.tell())
+            shapes.append(image.shape)
+            f.write(np.ascontiguousarray(image).tobytes())
+        index_offset = f.tell()
+        f.write(json.dumps({'grayscale': grayscale, 'names': names, 'class_ids': class_ids,
+                            'offsets': offsets, 'shapes': shapes}).encode())
+        f.write(np.uint64(index_offset).tobytes())
+    return len(names)
+
+class PackedDataset:
+    """Images of a pack_folder file, read zero-copy through numpy.memmap
+    
+    Every process maps the same file, so they share the page cache. The images are
+    read-only views into the map.
+    """
+    def __init__(self, path):
+        self.path = path
+        self.data = np.memmap(path, dtype=np.uint8, mode='r')
+        if bytes(self.data[:len(MAGIC)]) != MAGIC:
+            raise ValueError(f'Not a packed dataset: {path}')
+        index_offset = int(self.data[-8:].view('<u8')[0])
+        index = json.loads(bytes(self.data[index_offset:-8]))
+        self.grayscale = index['grayscale']
+        self.names = index['names']
+        self.class_ids = np.array(index['class_ids'])
+        self.offsets = np.array(index['offsets'], dtype=np.int64)
+        self.shapes = [tuple(shape) for shape in index['shapes']]
+
+    def __len__(self):
+        return len(self.names)
+
+    def __getitem__(self, i):
+        shape = self.shapes[i]
+        return self.data[self.offsets[i]:self.offsets[i] + np.prod(shape)].reshape(shape)
+
+    def filename(self, i):
+        """Name of image i, its path relative to the packed folder (see common.image_name)"""
+        return self.names[i]
+
+    def __iter__(self):
+        """(filename, image) pairs, as accepted by stream.iterClassify"""
+        for i in range(len(self)):
+            yield self.filename(i), self[i]
+
+opened = {}
+
+def open_pack(path):
+    """PackedDataset of path, mapped once per process"""
+    if path not in opened:
+        opened[path] = PackedDataset(path)
+    return opened[path]
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Pack an image folder tree into one memory-mappable file')
+    parser.add_argument('input', help='folder of the images, class folders included')
+    parser.add_argument('output', help='the .pack file')
+    parser.add_argument('--grayscale', action='store_true', help='store grayscale images')
+    return parser.parse_args()
+
+def main():
+    args = parse_args()
+    if not args.output.endswith('.pack'):
+        sys.exit('The packed file needs the .pack extension')
+    count = pack_folder(args.input, args.output, args.grayscale)
+    print(f'{count} images packed into {args.output} ({os.path.getsize(args.output) / 2**20:.1f} MB)')
+
+if __name__ == "__main__":
+    main()
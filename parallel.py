@@ -0,0 +1,126 @@
+import os
+import cv2
+from collections import Counter
+from functools import partial
+from multiprocessing import Pool
+
+import common
+import context
+import pack
+from cache import config_key, file_key, frame_key, pipeline_config
+from cascade import load_cascade
+from common import image_name, list_images
+from output import OutputWriter
+from pipeline import get_pipeline
+from prefetch import decode
+
+def classify_record(image, filename, classifier='images', ctx=None, thresholds=None):
+    """Classify one decoded image with the given classifier and return its Record
+    
+    ctx: the context.ImageContext of image, to reuse its stages across classifiers
+    thresholds: 'inline' or 'fused' threshold stage, the one of the pipeline by default
+    """
+    if classifier == 'cascade':
+        return get_pipeline('images', thresholds).record(image, filename, ctx, load_cascade())
+    return get_pipeline(classifier, thresholds).record(image, filename, ctx)
+
+def output_of(classifier):
+    """'draw' or 'copy', the default output mode of a classifier (see pipeline.PIPELINES)"""
+    return get_pipeline('images' if classifier == 'cascade' else classifier).config['output']
+
+def classify_file(image_path, writer, classifier='images', max_size=None, cache=None, input_folder=None,
+                  thresholds=None):
+    """Worker: read, classify and save one image. Errors are returned in the Record
+    
+    writer: the output.OutputWriter of the outputs, None writes nothing
+    cache: a cache.ResultCache, images already classified with the same pipeline
+    configuration are not decoded again unless their output needs it
+    input_folder: the Record is named by the path relative to it (see common.image_name),
+    by the basename without one
+    """
+    filename = image_name(image_path, input_folder) if input_folder else os.path.basename(image_path)
+    try:
+        image = record = None
+        if cache is not None:
+            keys = (file_key(image_path), config_key(pipeline_config(classifier, max_size)))
+            record = cache.get(*keys, filename)
+        if record is None:
+            image = decode(image_path)
+            if image is None:
+                return common.Record(filename, 'Not Found', error="Image Couldn't Read")
+            ctx = context.ImageContext(image, max_size=max_size)
+            record = classify_record(image, filename, classifier, ctx, thresholds)
+            if cache is not None:
+                cache.put(*keys, record)
+        if writer is not None:
+            if image is None and writer.needs_image(record, image_path):
+                image = cv2.imread(image_path)
+            writer.write(image, image_path, record)
+        return record
+    except Exception as e:
+        return common.Record(filename, 'Not Found', error=f'{type(e).__name__}: {e}')
+
+def classify_packed(index, pack_path, writer, classifier='images', max_size=None, cache=None,
+                    thresholds=None):
+    """Worker: classify and save one image of a pack.py file, read through its memmap"""
+    dataset = pack.open_pack(pack_path)
+    filename = dataset.filename(index)
+    try:
+        image = dataset[index]
+        record = None
+        if cache is not None:
+            keys = (frame_key(image), config_key(pipeline_config(classifier, max_size)))
+            record = cache.get(*keys, filename)
+        if record is None:
+            record = classify_record(image, filename, classifier,
+                                     context.ImageContext(image, max_size=max_size), thresholds)
+            if cache is not None:
+                cache.put(*keys, record)
+        if writer is not None:
+            writer.write(image, None, record)
+        return record
+    except Exception as e:
+        return common.Record(filename, 'Not Found', error=f'{type(e).__name__}: {e}')
+
+def classifyParallel(input_folder, output_folder, classifier='images', workers=None, chunksize=16,
+                     max_size=None, cache=None, writer=None, thresholds=None):
+    """classify every image under input_folder on a pool of worker processes
+    
+    input_folder: a folder (class folders included) or a pack.py file, whose map
+    is shared by the workers
+    workers: number of processes, None uses every core and 1 runs in this process
+    chunksize: number of images sent to a worker at once
+    max_size: downscale every image to this larger side before thresholding
+    cache: a cache.ResultCache shared by the workers, only new or changed images are classified
+    writer: the output.OutputWriter of the outputs, by default the output mode of the
+    classifier into output_folder (None writes nothing). The workers write their images
+    and the manifest is written here.
+    thresholds: 'inline' or 'fused' threshold stage, the one of the classifier by default
+    Returns the Records in the same order as list_images.
+    """
+    if writer is None and output_folder is not None:
+        writer = OutputWriter(output_folder, output_of(classifier), workers=0)
+    if pack.is_pack(input_folder):
+        paths = range(len(pack.open_pack(input_folder)))
+        worker = partial(classify_packed, pack_path=input_folder, writer=writer,
+                         classifier=classifier, max_size=max_size, cache=cache, thresholds=thresholds)
+    else:
+        paths = list_images(input_folder)
+        worker = partial(classify_file, writer=writer, classifier=classifier,
+                         max_size=max_size, cache=cache, input_folder=input_folder, thresholds=thresholds)
+    workers = workers or os.cpu_count()
+    if workers == 1:
+        records = [worker(path) for path in paths]
+    else:
+        with Pool(workers) as pool:
+            records = list(pool.imap(worker, paths, chunksize=chunksize))
+    if writer is not None:
+        writer.finish(records)
+        writer.close()
+
+    for record in records:
+        if record.error:
+            print(f'{record.filename}: {record.error}')
+    counts = Counter(record.shape for record in records if not record.error)
+    print(f'{len(records)} images classified with {workers} workers: {dict(counts)}')
+    return records
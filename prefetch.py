@@ -0,0 +1,56 @@
+import cv2
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+import common
+import instrument
+import pack
+
+def decode(path, flags=cv2.IMREAD_COLOR):
+    """cv2.imread, traced as the decode stage"""
+    with instrument.span('decode', 'io'):
+        return cv2.imread(path, flags)
+
+def prefetch_images(paths, workers=4, queue_size=16, grayscale=False):
+    """Yield (path, image) in the order of paths while the next ones are decoded
+    
+    cv2.imread releases the GIL, so up to queue_size images are read and decoded by
+    background threads while the caller processes the current one. image is None
+    when the file can't be read, as with cv2.imread.
+    grayscale: decode with IMREAD_GRAYSCALE. libpng's conversion may differ from
+    cv2.cvtColor by one gray level, so results can change slightly.
+    """
+    flags = cv2.IMREAD_GRAYSCALE if grayscale else cv2.IMREAD_COLOR
+    paths = iter(paths)
+    pending = deque()
+    executor = ThreadPoolExecutor(workers)
+    try:
+        for path in paths:
+            pending.append((path, executor.submit(decode, path, flags)))
+            if len(pending) >= queue_size:
+                break
+        while pending:
+            path, future = pending.popleft()
+            next_path = next(paths, None)
+            if next_path is not None:
+                pending.append((next_path, executor.submit(decode, next_path, flags)))
+            yield path, future.result()
+    finally:
+        executor.shutdown(wait=False, cancel_futures=True)
+
+def read_images(input_folder, extensions, grayscale=False):
+    """Yield (filename, image_path, image) for the classifier loops
+    
+    input_folder is a folder, whose images (class folders included) are prefetched, or a pack.py file whose
+    images are memory-mapped; image_path is None for those. filename is the path
+    relative to input_folder (see common.image_name).
+    """
+    if pack.is_pack(input_folder):
+        dataset = pack.open_pack(input_folder)
+        for i in range(len(dataset)):
+            yield dataset.filename(i), None, dataset[i]
+        return
+    # the same images, class folders included, as the parallel and streaming engines
+    paths = [path for path in common.list_images(input_folder) if path.lower().endswith(extensions)]
+    for image_path, image in prefetch_images(paths, grayscale=grayscale):
+        yield common.image_name(image_path, input_folder), image_path, image
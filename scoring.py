@@ -0,0 +1,84 @@
+import numpy as np
+from typing import NamedTuple
+
+# Scoring of classifyimages (circle-like contours get their circularity doubled)
+IMAGES_SCORING = {'circularity': 0.3, 'center': 0.3, 'size': 0.4,
+                  'target_ratio': 0.4, 'max_ratio': 0.9, 'circle_boost': 0.8}
+# Scoring of classifyQuality
+QUALITY_SCORING = {'circularity': 0.2, 'center': 0.3, 'size': 0.4,
+                   'target_ratio': 0.3, 'max_ratio': 0.8, 'circle_boost': None}
+
+class ContourFeatures(NamedTuple):
+    """Per contour geometry of one image, every field is an array of len(contours)"""
+    area: np.ndarray
+    perimeter: np.ndarray
+    cx: np.ndarray
+    cy: np.ndarray
+    m00: np.ndarray
+
+def contour_features(contours):
+    """Area, perimeter and centroid of all contours in one vectorized pass
+    
+    Same values as cv2.contourArea, cv2.arcLength(closed=True) and cv2.moments,
+    computed with the shoelace formula over the concatenated points.
+    """
+    n = len(contours)
+    if n == 0:
+        empty = np.zeros(0)
+        return ContourFeatures(empty, empty, empty, empty, empty)
+    lengths = np.fromiter((len(c) for c in contours), dtype=np.intp, count=n)
+    points = np.concatenate(contours).reshape(-1, 2).astype(np.float64)
+    starts = np.zeros(n, dtype=np.intp)
+    np.cumsum(lengths[:-1], out=starts[1:])
+    # Index of the next point, the last point of a contour wraps to its first one
+    nxt = np.arange(1, len(points) + 1)
+    nxt[starts + lengths - 1] = starts
+    x, y = points[:, 0], points[:, 1]
+    x1, y1 = x[nxt], y[nxt]
+    cross = x * y1 - x1 * y
+
+    m00 = np.add.reduceat(cross, starts) / 2
+    m10 = np.add.reduceat((x + x1) * cross, starts) / 6
+    m01 = np.add.reduceat((y + y1) * cross, starts) / 6
+    perimeter = np.add.reduceat(np.hypot(x1 - x, y1 - y), starts)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        cx = np.where(m00 != 0, m10 / m00, 0)
+        cy = np.where(m00 != 0, m01 / m00, 0)
+    return ContourFeatures(np.abs(m00), perimeter, cx, cy, m00)
+
+def score_contours(features, image_shape, params=IMAGES_SCORING):
+    """Quality score of every contour, the vectorized evaluate_contour_quality"""
+    area, perimeter = features.area, features.perimeter
+    height, width = image_shape[0], image_shape[1]
+
+    # Regularity of shape (closer to 1 means more regular)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        circularity = np.where(perimeter > 0, 4 * np.pi * area / (perimeter * perimeter), 0)
+    if params['circle_boost'] is not None:
+        circularity = np.where(circularity >= params['circle_boost'], circularity * 2, circularity)
+
+    # Center distance
+    center_dist = np.hypot(features.cx - width / 2, features.cy - height / 2)
+    center_score = np.where(features.m00 != 0,
+                            1 - center_dist / (np.sqrt(height**2 + width**2) / 2), 0)
+
+    # The size of the contour (not too small or too large)
+    area_ratio = area / (height * width)
+    size_score = np.where(area_ratio <= params['max_ratio'],
+                          1 - np.abs(params['target_ratio'] - area_ratio), 0)
+
+    return (params['circularity'] * circularity +
+            params['center'] * center_score +
+            params['size'] * size_score)
+
+def best_index(scores, mask, last=False):
+    """Index of the highest score among the contours in mask, None if mask is empty
+    
+    Ties go to the first contour, or to the last one with last=True.
+    """
+    if not mask.any():
+        return None
+    masked = np.where(mask, scores, -np.inf)
+    if last:
+        return len(masked) - 1 - int(np.argmax(masked[::-1]))
+    return int(np.argmax(masked))
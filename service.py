@@ -0,0 +1,298 @@
+import sys
+import json
+import time
+import queue
+import signal
+import argparse
+import threading
+import cv2
+import numpy as np
+from collections import deque
+from concurrent.futures import Future
+from functools import partial
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from multiprocessing import Pool
+from urllib.parse import parse_qs, urlparse
+
+import common
+from common import CLASSIFIERS
+from parallel import classify_record
+
+def warm_worker(classifiers):
+    """Pool initializer: build the pipelines (and the template index) before the first request"""
+    image = np.zeros((64, 64, 3), dtype=np.uint8)
+    cv2.circle(image, (32, 32), 20, (255, 255, 255), -1)
+    for classifier in classifiers:
+        classify_record(image, 'warmup', classifier)
+
+def classify_batch(requests):
+    """Worker: decode and classify a batch of (filename, classifier, encoded image) requests
+
+    Returns the Record of every request as a dict, errors are reported in its error field.
+    """
+    records = []
+    for filename, classifier, data in requests:
+        try:
+            image = cv2.imdecode(np.frombuffer(data, dtype=np.uint8), cv2.IMREAD_COLOR)
+            if image is None:
+                record = common.Record(filename, 'Not Found', error="Image Couldn't Read")
+            else:
+                record = classify_record(image, filename, classifier)
+        except Exception as e:
+            record = common.Record(filename, 'Not Found', error=f'{type(e).__name__}: {e}')
+        records.append(record.to_dict())
+    return records
+
+class Metrics:
+    """Counters and latencies of the service, served by GET /metrics
+
+    window: seconds of the recent throughput and latency percentiles
+    """
+    def __init__(self, window=10):
+        self.lock = threading.Lock()
+        self.window = window
+        self.start = time.perf_counter()
+        self.counts = {'accepted': 0, 'rejected': 0, 'completed': 0, 'errors': 0, 'batches': 0}
+        # (completion time, latency) of the recent requests
+        self.recent = deque()
+
+    def add(self, name, value=1):
+        with self.lock:
+            self.counts[name] += value
+
+    def completed(self, latencies, errors):
+        now = time.perf_counter()
+        with self.lock:
+            self.counts['completed'] += len(latencies)
+            self.counts['errors'] += errors
+            self.counts['batches'] += 1
+            self.recent.extend((now, latency) for latency in latencies)
+
+    def snapshot(self, queue_depth, in_flight):
+        now = time.perf_counter()
+        with self.lock:
+            while self.recent and self.recent[0][0] < now - self.window:
+                self.recent.popleft()
+            counts = dict(self.counts)
+            latencies_ms = np.array([latency for _, latency in self.recent]) * 1000
+        uptime = now - self.start
+        snapshot = {
+            **counts,
+            'uptime_s': uptime,
+            'queue_depth': queue_depth,
+            'batches_in_flight': in_flight,
+            'mean_batch': counts['completed'] / counts['batches'] if counts['batches'] else 0.0,
+            'throughput_qps': counts['completed'] / uptime,
+            'recent_qps': len(latencies_ms) / min(self.window, uptime),
+            'latency_ms': None,
+        }
+        if len(latencies_ms):
+            snapshot['latency_ms'] = {
+                'p50': float(np.percentile(latencies_ms, 50)),
+                'p95': float(np.percentile(latencies_ms, 95)),
+                'p99': float(np.percentile(latencies_ms, 99)),
+                'max': float(latencies_ms.max()),
+            }
+        return snapshot
+
+class Batcher:
+    """Groups the queued requests into micro-batches classified by warm worker processes
+
+    max_batch, max_wait: a batch leaves once it has max_batch requests or its oldest
+    request has waited max_wait seconds for batch mates
+    queue_size: requests waiting for a batch beyond it are rejected, the backpressure of
+    the clients
+    Every worker has at most one batch in flight, so the queue fills while they are
+    busy and the next batches are bigger.
+    """
+    def __init__(self, workers, classifiers=('images',), max_batch=8, max_wait=0.002, queue_size=64):
+        self.workers = workers
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+        self.queue = queue.Queue(queue_size)
+        self.metrics = Metrics()
+        self.slots = threading.Semaphore(workers)
+        self.lock = threading.Lock()
+        self.in_flight = 0
+        self.pool = Pool(workers, warm_worker, (classifiers,))
+        self.thread = threading.Thread(target=self.loop, daemon=True)
+        self.thread.start()
+
+    def submit(self, filename, classifier, data):
+        """Future of the Record dict of one request, raises queue.Full when the queue is"""
+        future = Future()
+        try:
+            self.queue.put_nowait((time.perf_counter(), (filename, classifier, data), future))
+        except queue.Full:
+            self.metrics.add('rejected')
+            raise
+        self.metrics.add('accepted')
+        return future
+
+    def next_batch(self, first):
+        """first and the requests queued until the batch is full or its deadline passed"""
+        batch = [first]
+        deadline = first[0] + self.max_wait
+        while len(batch) < self.max_batch:
+            timeout = deadline - time.perf_counter()
+            try:
+                # past the deadline only the requests already waiting join the batch
+                item = self.queue.get(timeout=timeout) if timeout > 0 else self.queue.get_nowait()
+            except queue.Empty:
+                break
+            if item is None:
+                self.queue.put(None)
+                break
+            batch.append(item)
+        return batch
+
+    def loop(self):
+        while True:
+            first = self.queue.get()
+            if first is None:
+                break
+            # wait for a free worker, the requests arriving meanwhile join this batch
+            self.slots.acquire()
+            batch = self.next_batch(first)
+            with self.lock:
+                self.in_flight += 1
+            self.pool.apply_async(classify_batch, ([request for _, request, _ in batch],),
+                                  callback=partial(self.done, batch),
+                                  error_callback=partial(self.failed, batch))
+
+    def release(self):
+        with self.lock:
+            self.in_flight -= 1
+        self.slots.release()
+
+    def done(self, batch, records):
+        now = time.perf_counter()
+        self.release()
+        for (start, _, future), record in zip(batch, records):
+            future.set_result(record)
+        self.metrics.completed([now - start for start, _, _ in batch],
+                               sum(1 for record in records if record['error']))
+
+    def failed(self, batch, error):
+        self.release()
+        for _, _, future in batch:
+            future.set_exception(error)
+        self.metrics.completed([], len(batch))
+
+    def snapshot(self):
+        return self.metrics.snapshot(self.queue.qsize(), self.in_flight)
+
+    def close(self):
+        self.queue.put(None)
+        self.thread.join()
+        self.pool.close()
+        self.pool.join()
+
+class Handler(BaseHTTPRequestHandler):
+    """POST /classify?classifier=images&filename=a.png with the encoded image as body,
+    GET /metrics and GET /health"""
+    protocol_version = 'HTTP/1.1'
+    # the headers and the body are two writes, without TCP_NODELAY the reply waits
+    # for the delayed ACK of the client
+    disable_nagle_algorithm = True
+
+    def reply(self, status, body, headers=None):
+        data = json.dumps(body, default=float).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        path = urlparse(self.path).path
+        if path == '/metrics':
+            self.reply(200, self.server.batcher.snapshot())
+        elif path == '/health':
+            self.reply(200, {'status': 'ok', 'classifiers': self.server.classifiers})
+        else:
+            self.reply(404, {'error': f'Unknown path: {path}'})
+
+    def do_POST(self):
+        url = urlparse(self.path)
+        data = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        if url.path != '/classify':
+            self.reply(404, {'error': f'Unknown path: {url.path}'})
+            return
+        params = parse_qs(url.query)
+        classifier = params.get('classifier', [self.server.classifiers[0]])[0]
+        if classifier not in self.server.classifiers:
+            self.reply(400, {'error': f'Classifier not served: {classifier}'})
+            return
+        filename = params.get('filename', ['image'])[0]
+        try:
+            future = self.server.batcher.submit(filename, classifier, data)
+        except queue.Full:
+            self.reply(503, {'error': 'Queue full'}, {'Retry-After': '1'})
+            return
+        try:
+            self.reply(200, future.result(timeout=self.server.request_timeout))
+        except TimeoutError:
+            self.reply(504, {'error': 'Timed out'})
+        except Exception as e:
+            self.reply(500, {'error': f'{type(e).__name__}: {e}'})
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            super().log_message(format, *args)
+
+class Server(ThreadingHTTPServer):
+    daemon_threads = True
+    # connections waiting to be accepted, the default 5 resets the bursts of many clients
+    request_queue_size = 128
+
+def interrupt(signum, frame):
+    """SIGTERM stops the service like Ctrl-C, the queued requests are answered first"""
+    raise KeyboardInterrupt
+
+def serve(host='127.0.0.1', port=8080, classifiers=('images',), workers=4, max_batch=8,
+          max_wait=0.002, queue_size=64, request_timeout=30, verbose=False):
+    """Serve the shape detection over HTTP until interrupted, see Handler and Batcher"""
+    batcher = Batcher(workers, classifiers, max_batch, max_wait, queue_size)
+    # set after the workers started, they keep the default handlers
+    signal.signal(signal.SIGTERM, interrupt)
+    server = Server((host, port), Handler)
+    server.batcher = batcher
+    server.classifiers = list(classifiers)
+    server.request_timeout = request_timeout
+    server.verbose = verbose
+    print(f'Serving {", ".join(classifiers)} on http://{host}:{server.server_port} with {workers} workers',
+          file=sys.stderr)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        batcher.close()
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Local shape detection service')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument('--classifier', nargs='+', default=['images'], choices=CLASSIFIERS,
+                        help='classifiers served, the first one is the default')
+    parser.add_argument('--workers', type=int, default=4, help='warm worker processes')
+    parser.add_argument('--max-batch', type=int, default=8, help='requests per micro-batch')
+    parser.add_argument('--max-wait-ms', type=float, default=2,
+                        help='longest wait of a request for its batch mates')
+    parser.add_argument('--queue-size', type=int, default=64,
+                        help='waiting requests beyond it are rejected with 503')
+    parser.add_argument('--timeout', type=float, default=30, help='seconds before a request fails with 504')
+    parser.add_argument('--verbose', action='store_true', help='log every request')
+    return parser.parse_args()
+
+def main():
+    args = parse_args()
+    serve(args.host, args.port, args.classifier, args.workers, args.max_batch,
+          args.max_wait_ms / 1000, args.queue_size, args.timeout, args.verbose)
+
+if __name__ == "__main__":
+    main()
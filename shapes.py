@@ -0,0 +1,209 @@
+import os
+import sys
+import json
+import hashlib
+import argparse
+import cv2
+import numpy as np
+
+from annotations import ANNOTATION_FILE
+
+SHAPE_INDEX_FILE = 'shape_index.npz'
+# Points of the resampled contour and Fourier harmonics kept in a signature
+SAMPLES = 64
+HARMONICS = 16
+# Shapes of the template index, a diamond is a rectangle standing on a corner
+TEMPLATE_SHAPES = ('triangle', 'rectangle', 'octagon', 'circle')
+VERTICES = {'triangle': 3, 'rectangle': 4, 'diamond': 4, 'octagon': 8, 'circle': 0, 'unknown': 0}
+
+def resample(contours, samples=SAMPLES):
+    """Every contour resampled to samples points evenly spaced along its perimeter
+
+    All contours are interpolated at once over their concatenated points, returns a
+    (contours, samples, 2) array.
+    """
+    n = len(contours)
+    lengths = np.fromiter((len(c) for c in contours), dtype=np.intp, count=n)
+    points = np.concatenate(contours).reshape(-1, 2).astype(np.float64)
+    starts = np.zeros(n, dtype=np.intp)
+    np.cumsum(lengths[:-1], out=starts[1:])
+    # the last point of a contour wraps to its first one, as in scoring.contour_features
+    nxt = np.arange(1, len(points) + 1)
+    nxt[starts + lengths - 1] = starts
+    steps = np.hypot(*(points[nxt] - points).T)
+    # arc length at the start of every segment, over all contours
+    arc = np.concatenate([[0], np.cumsum(steps)])
+    perimeters = arc[starts + lengths] - arc[starts]
+    targets = arc[starts][:, None] + perimeters[:, None] * np.arange(samples) / samples
+    segment = np.searchsorted(arc, targets, side='right') - 1
+    # stay inside the contour when a target falls on its closing point
+    segment = np.clip(segment, starts[:, None], (starts + lengths - 1)[:, None])
+    with np.errstate(divide='ignore', invalid='ignore'):
+        t = np.where(steps[segment] > 0, (targets - arc[segment]) / steps[segment], 0)
+    return points[segment] + t[..., None] * (points[nxt[segment]] - points[segment])
+
+def signatures(contours, samples=SAMPLES, harmonics=HARMONICS):
+    """Fourier magnitudes of the centroid distance of every contour, (contours, harmonics)
+
+    The distances are divided by their mean (scale), only the magnitudes are kept
+    (rotation and starting point), so similar shapes get close signatures.
+    """
+    if len(contours) == 0:
+        return np.zeros((0, harmonics), dtype=np.float32)
+    points = resample(contours, samples)
+    radius = np.hypot(*(points - points.mean(axis=1, keepdims=True)).transpose(2, 0, 1))
+    with np.errstate(divide='ignore', invalid='ignore'):
+        radius = np.nan_to_num(radius / radius.mean(axis=1, keepdims=True))
+    spectrum = np.abs(np.fft.rfft(radius, axis=1))[:, 1:harmonics + 1] / samples
+    return spectrum.astype(np.float32)
+
+def is_diamond(contour):
+    """Whether a rectangle stands on a corner (sides at about 45 degrees)"""
+    (_, _), (_, _), angle = cv2.minAreaRect(contour)
+    return 30 <= angle % 90 <= 60
+
+def synthetic_templates(size=96):
+    """Contours of drawn shapes: rounded corners, aspect ratios and rotations of every shape"""
+    contours, labels = [], []
+    center = np.array([size, size], dtype=np.float64)
+    for shape in TEMPLATE_SHAPES:
+        corners = {'triangle': 3, 'rectangle': 4, 'octagon': 8, 'circle': 64}[shape]
+        aspects = (1.0, 1.4, 2.0) if shape == 'rectangle' else (1.0, 1.15)
+        for aspect in aspects:
+            for rotation in (0, 10, 25, 45):
+                for rounding in (0, 5, 11):
+                    angles = np.radians(rotation + 90 + 360 * np.arange(corners) / corners)
+                    if shape in ('rectangle', 'octagon'):
+                        angles += np.pi / corners
+                    polygon = np.stack([np.cos(angles) * aspect, np.sin(angles)], axis=1) * size * 0.6
+                    mask = np.zeros((2 * size, 2 * size), dtype=np.uint8)
+                    cv2.fillPoly(mask, [np.round(polygon + center).astype(np.int32)], 255)
+                    if rounding:
+                        kernel = cv2.getStructuringElement(cv2.MORPH_ELLIPSE, (2 * rounding + 1,) * 2)
+                        mask = cv2.morphologyEx(mask, cv2.MORPH_OPEN, kernel)
+                    ctrs, _ = cv2.findContours(mask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_NONE)
+                    contours.append(max(ctrs, key=len))
+                    labels.append(shape)
+    return contours, labels
+
+class TemplateIndex:
+    """Signatures of labeled exemplar contours, queried by nearest neighbour
+
+    max_distance: contours farther from every template are 'unknown', None labels all
+    """
+    def __init__(self, templates, labels, k=1, max_distance=None):
+        self.templates = np.asarray(templates, dtype=np.float32)
+        self.labels = np.asarray(labels)
+        self.norms = (self.templates ** 2).sum(axis=1)
+        self.k = k
+        self.max_distance = max_distance
+
+    @classmethod
+    def from_contours(cls, contours, labels, **options):
+        return cls(signatures(contours), labels, **options)
+
+    def nearest(self, queries):
+        """(indices, distances) of the k nearest templates of every signature"""
+        distances = (queries ** 2).sum(axis=1)[:, None] + self.norms - 2 * queries @ self.templates.T
+        distances = np.sqrt(np.maximum(distances, 0))
+        k = min(self.k, len(self.templates))
+        indices = np.argsort(distances, axis=1)[:, :k]
+        return indices, np.take_along_axis(distances, indices, axis=1)
+
+    def label(self, contours):
+        """Shape name of every contour, all of them matched in one batch"""
+        if len(contours) == 0:
+            return []
+        indices, distances = self.nearest(signatures(contours))
+        shapes = []
+        for contour, neighbours, distance in zip(contours, indices, distances):
+            if len(neighbours) == 1:
+                shape = str(self.labels[neighbours[0]])
+            else:
+                names, counts = np.unique(self.labels[neighbours], return_counts=True)
+                shape = str(names[np.argmax(counts)])
+            if self.max_distance is not None and distance[0] > self.max_distance:
+                shape = 'unknown'
+            elif shape == 'rectangle' and is_diamond(contour):
+                shape = 'diamond'
+            shapes.append(shape)
+        return shapes
+
+    def save(self, path):
+        np.savez_compressed(path, templates=self.templates, labels=self.labels,
+                            k=self.k, max_distance=np.nan if self.max_distance is None else self.max_distance)
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as data:
+            max_distance = float(data['max_distance'])
+            return cls(data['templates'], data['labels'], int(data['k']),
+                       None if np.isnan(max_distance) else max_distance)
+
+    def digest(self):
+        """Hash of the templates, for the cache keys of the results labeled with them"""
+        digest = hashlib.sha1(self.templates.tobytes())
+        digest.update(' '.join(self.labels.tolist()).encode())
+        return digest.hexdigest()
+
+loaded = {}
+
+def load_index(path=SHAPE_INDEX_FILE):
+    """Template index of path, built from synthetic_templates if it was never built"""
+    if path not in loaded:
+        if os.path.exists(path):
+            loaded[path] = TemplateIndex.load(path)
+        else:
+            loaded[path] = TemplateIndex.from_contours(*synthetic_templates())
+    return loaded[path]
+
+def exemplar_contours(items, classifier='images'):
+    """Best contour of every labeled (image_path, shape) item of a template shape"""
+    from parallel import classify_record
+    contours, labels = [], []
+    for path, shape in items:
+        if shape not in TEMPLATE_SHAPES:
+            continue
+        image = cv2.imread(path)
+        if image is None:
+            continue
+        record = classify_record(image, os.path.basename(path), classifier)
+        if record.ctr is not None and len(record.ctr) > 2:
+            contours.append(record.ctr)
+            labels.append(shape)
+    return contours, labels
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Build the shape template index')
+    parser.add_argument('--input', default='traffic_Data/DATA',
+                        help='labeled images added to the synthetic templates')
+    parser.add_argument('--ground-truth', default=ANNOTATION_FILE,
+                        help='annotation store of groundTruth.py, or an old ground_truth.json')
+    parser.add_argument('--labels', help='JSON file {class id: shape}, labels whole class folders')
+    parser.add_argument('--stride', type=int, default=1, help='use every n-th labeled image only')
+    parser.add_argument('--k', type=int, default=1, help='neighbours voting for a label')
+    parser.add_argument('--max-distance', type=float, help='farther contours are unknown')
+    parser.add_argument('--output', default=SHAPE_INDEX_FILE)
+    return parser.parse_args()
+
+def main():
+    from evaluate import load_ground_truth
+    from tune import class_labels, labeled_items
+    args = parse_args()
+    ground_truth = load_ground_truth(args.ground_truth)
+    labels = None
+    if args.labels:
+        with open(args.labels) as f:
+            labels = json.load(f)
+    items = labeled_items(args.input, ground_truth, class_labels(ground_truth, labels))[::args.stride]
+    contours, shapes = synthetic_templates()
+    exemplars, exemplar_shapes = exemplar_contours(items)
+    index = TemplateIndex.from_contours(contours + exemplars, shapes + exemplar_shapes,
+                                        k=args.k, max_distance=args.max_distance)
+    index.save(args.output)
+    names, counts = np.unique(index.labels, return_counts=True)
+    counts = {str(name): int(count) for name, count in zip(names, counts)}
+    print(f'{len(index.labels)} templates saved to {args.output}: {counts}', file=sys.stderr)
+
+if __name__ == "__main__":
+    main()
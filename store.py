@@ -0,0 +1,173 @@
+import csv
+import numpy as np
+
+from pack import class_id
+
+# One row per image, the strings are small integer codes and the contour is a
+# slice [ctr_offset, ctr_offset + ctr_length) of the shared points buffer
+ROW_DTYPE = np.dtype([
+    ('shape', np.uint8),
+    ('method', np.uint8),
+    ('score', np.float32),
+    ('num_vertices', np.uint16),
+    ('box', np.int32, 4),
+    ('class_id', np.int16),
+    ('ctr_offset', np.int64),
+    ('ctr_length', np.int32),
+])
+
+def grow(array, needed):
+    """array with room for at least needed rows, doubling the capacity"""
+    if needed <= len(array):
+        return array
+    grown = np.zeros((max(needed, 2 * len(array)),) + array.shape[1:], dtype=array.dtype)
+    grown[:len(array)] = array
+    return grown
+
+class ResultStore:
+    """Columnar store of common.Records backed by numpy arrays
+    
+    Far smaller than a list of Records: a row is 38 bytes (ROW_DTYPE) plus 8 bytes per contour
+    point, shape and method names are stored once in a vocabulary.
+    """
+    def __init__(self, capacity=1024):
+        self._rows = np.zeros(capacity, dtype=ROW_DTYPE)
+        self._points = np.zeros((capacity * 64, 2), dtype=np.int32)
+        self.size = 0
+        self.points_size = 0
+        self.filenames = []
+        self.shape_names = []
+        self.method_names = []
+
+    @classmethod
+    def from_records(cls, records):
+        store = cls()
+        store.extend(records)
+        return store
+
+    def __len__(self):
+        return self.size
+
+    @property
+    def rows(self):
+        """Structured array of the rows (a view, no copy)"""
+        return self._rows[:self.size]
+
+    @property
+    def points(self):
+        return self._points[:self.points_size]
+
+    def code(self, names, name):
+        if name not in names:
+            names.append(name)
+        return names.index(name)
+
+    def add(self, record):
+        """Append one common.Record"""
+        self._rows = grow(self._rows, self.size + 1)
+        row = self._rows[self.size]
+        row['shape'] = self.code(self.shape_names, record.shape)
+        row['method'] = self.code(self.method_names, record.method)
+        row['score'] = record.score
+        row['num_vertices'] = record.num_vertices
+        row['class_id'] = class_id(record.filename.replace('\\', '/').rsplit('/', 1)[-1])
+        row['ctr_offset'] = self.points_size
+        if record.ctr is not None:
+            points = record.ctr.reshape(-1, 2)
+            self._points = grow(self._points, self.points_size + len(points))
+            self._points[self.points_size:self.points_size + len(points)] = points
+            self.points_size += len(points)
+            row['ctr_length'] = len(points)
+            if record.box is not None:
+                row['box'] = record.box
+            elif len(points):
+                row['box'] = (*points.min(axis=0), *(points.max(axis=0) + 1))
+        self.filenames.append(record.filename)
+        self.size += 1
+
+    def extend(self, records):
+        for record in records:
+            self.add(record)
+
+    def contour(self, i):
+        """Contour of row i as a (n, 1, 2) view into the points buffer"""
+        row = self._rows[i]
+        return self._points[row['ctr_offset']:row['ctr_offset'] + row['ctr_length']].reshape(-1, 1, 2)
+
+    def shapes(self):
+        """Shape name of every row"""
+        return np.array(self.shape_names, dtype=object)[self.rows['shape']]
+
+    def mask(self, shape=None, method=None, min_score=None, class_id=None):
+        """Boolean mask of the rows matching every given condition"""
+        rows = self.rows
+        mask = np.ones(self.size, dtype=bool)
+        if shape is not None:
+            mask &= rows['shape'] == (self.shape_names.index(shape) if shape in self.shape_names else -1)
+        if method is not None:
+            mask &= rows['method'] == (self.method_names.index(method) if method in self.method_names else -1)
+        if min_score is not None:
+            mask &= rows['score'] >= min_score
+        if class_id is not None:
+            mask &= rows['class_id'] == class_id
+        return mask
+
+    def filter(self, mask):
+        """New store with the rows of mask, their contours are compacted"""
+        store = ResultStore(max(1, int(np.count_nonzero(mask))))
+        store.shape_names = list(self.shape_names)
+        store.method_names = list(self.method_names)
+        indices = np.flatnonzero(mask)
+        rows = self._rows[indices].copy()
+        lengths = rows['ctr_length'].astype(np.int64)
+        # gather the contour slices with one fancy index
+        starts = np.repeat(rows['ctr_offset'] - np.cumsum(lengths) + lengths, lengths)
+        points = self._points[starts + np.arange(lengths.sum())]
+        rows['ctr_offset'] = np.cumsum(lengths) - lengths
+        store._rows, store._points = rows, points
+        store.size, store.points_size = len(rows), len(points)
+        store.filenames = [self.filenames[i] for i in indices]
+        return store
+
+    def shape_counts(self, by='class_id'):
+        """(keys, shape_names, counts), counts[i, j] is the number of rows of key i with shape j
+        
+        by: 'class_id' or 'method'
+        """
+        keys, inverse = np.unique(self.rows[by], return_inverse=True)
+        counts = np.zeros((len(keys), len(self.shape_names)), dtype=np.int64)
+        np.add.at(counts, (inverse, self.rows['shape']), 1)
+        if by == 'method':
+            keys = [self.method_names[k] for k in keys]
+        return [k.item() if hasattr(k, "item") else k for k in keys], list(self.shape_names), counts
+
+    def save(self, path):
+        """Save to a compressed .npz file"""
+        np.savez_compressed(path, rows=self.rows, points=self.points,
+                            filenames=np.array(self.filenames, dtype=str),
+                            shape_names=np.array(self.shape_names, dtype=str),
+                            method_names=np.array([str(m) for m in self.method_names], dtype=str))
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as data:
+            store = cls(1)
+            store._rows, store._points = data['rows'], data['points']
+            store.size, store.points_size = len(store._rows), len(store._points)
+            store.filenames = data['filenames'].tolist()
+            store.shape_names = data['shape_names'].tolist()
+            store.method_names = [None if m == 'None' else m for m in data['method_names'].tolist()]
+        return store
+
+    def to_csv(self, path):
+        """Manifest of the rows without the contours"""
+        rows = self.rows
+        with open(path, 'w', newline='') as f:
+            writer = csv.writer(f)
+            writer.writerow(['filename', 'class_id', 'shape', 'method', 'score', 'num_vertices',
+                             'x0', 'y0', 'x1', 'y1'])
+            for i, filename in enumerate(self.filenames):
+                row = rows[i]
+                writer.writerow([filename, row['class_id'], self.shape_names[row['shape']],
+                                 self.method_names[row['method']], f"{row['score']:.6f}",
+                                 row['num_vertices'], *row['box']])
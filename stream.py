@@ -0,0 +1,67 @@
+import os
+import cv2
+import numpy as np
+
+import common
+import context
+import pack
+from common import list_images
+from cache import config_key, frame_key, pipeline_config
+from parallel import classify_file, classify_record
+
+def load_source(source, index):
+    """Filename and image of an in-memory source of iterClassify
+    
+    A decoded BGR frame or a (filename, frame) pair, image paths go through
+    parallel.classify_file.
+    """
+    if isinstance(source, np.ndarray):
+        return f'frame_{index:06d}', source
+    filename, image = source
+    return filename, image
+
+def iterClassify(sources, classifier='images', max_size=None, cache=None, thresholds=None):
+    """Lazily classify sources one by one and yield a common.Record per image
+    
+    sources: a folder, a pack.py file, or any iterable of paths / frames / (filename, frame) pairs.
+    Only the current image is decoded and held in memory, nothing is written to disk.
+    Errors are reported in Record.error and the iteration goes on.
+    max_size: downscale every image to this larger side before thresholding
+    cache: a cache.ResultCache, cached paths are not even decoded
+    thresholds: 'inline' or 'fused' threshold stage, the one of the classifier by default
+    """
+    input_folder = None
+    if isinstance(sources, (str, os.PathLike)):
+        if pack.is_pack(sources):
+            sources = pack.open_pack(sources)
+        else:
+            input_folder = sources
+            sources = list_images(sources)
+    if cache is not None:
+        key = config_key(pipeline_config(classifier, max_size))
+    for index, source in enumerate(sources):
+        if isinstance(source, (str, os.PathLike)):
+            yield classify_file(os.fspath(source), None, classifier, max_size, cache, input_folder,
+                                thresholds)
+            continue
+        filename = f'frame_{index:06d}'
+        try:
+            filename, image = load_source(source, index)
+            if image is None:
+                yield common.Record(filename, 'Not Found', error="Image Couldn't Read")
+                continue
+            if image.ndim == 2:
+                image = cv2.cvtColor(image, cv2.COLOR_GRAY2BGR)
+            if cache is not None:
+                image_key = frame_key(image)
+                record = cache.get(image_key, key, filename)
+                if record is not None:
+                    yield record
+                    continue
+            ctx = context.ImageContext(image, max_size=max_size)
+            record = classify_record(image, filename, classifier, ctx, thresholds)
+            if cache is not None:
+                cache.put(image_key, key, record)
+            yield record
+        except Exception as e:
+            yield common.Record(filename, 'Not Found', error=f'{type(e).__name__}: {e}')
@@ -0,0 +1,224 @@
+import os
+import sys
+import json
+import time
+import argparse
+import itertools
+import cv2
+import numpy as np
+from collections import Counter
+from functools import partial
+from multiprocessing import Pool
+
+import context
+import scoring
+from common import list_images
+from annotations import ANNOTATION_FILE
+from evaluate import load_ground_truth, normalize_shape
+from pack import class_id
+from pipeline import PIPELINES, Pipeline
+
+# Candidate values of every tuned constant, each combination is one configuration.
+# adaptive: (block size, C) of both adaptive methods, scoring: a name of SCORINGS.
+SWEEP = {
+    'preprocess': [('gaussian', 3), ('gaussian', 5)],
+    'adaptive': [(11, 2), (15, 2), (11, 5)],
+    'canny': [(50, 150), (60, 180), (50, 200)],
+    'epsilon': [0.01, 0.015, 0.02],
+    'circle_cutoff': [0.75, 0.8, 0.85],
+    'scoring': ['images', 'quality'],
+}
+SCORINGS = {
+    'images': scoring.IMAGES_SCORING,
+    'quality': scoring.QUALITY_SCORING,
+}
+
+def applies(base, parameter):
+    """Whether a SWEEP parameter changes the results of the base configuration"""
+    if parameter == 'circle_cutoff':
+        return base['shape'] == 'circularity'
+    if parameter == 'scoring':
+        return base['select'] == 'score'
+    return True
+
+def configure(base, params):
+    """Copy of a PIPELINES configuration with the swept params"""
+    config = dict(base)
+    for parameter, value in params.items():
+        if parameter == 'adaptive':
+            config['methods'] = [(name, (method[0], *value) if method[0].startswith('adaptive') else method)
+                                 for name, method in base['methods']]
+        elif parameter == 'scoring':
+            config['scoring'] = SCORINGS[value]
+        else:
+            config[parameter] = tuple(value) if isinstance(value, list) else value
+    return config
+
+def sweep_params(base, sweep=SWEEP):
+    """Every combination of the sweep parameters that apply to base, as dicts"""
+    parameters = [parameter for parameter in sweep if applies(base, parameter)]
+    return [dict(zip(parameters, values))
+            for values in itertools.product(*(sweep[parameter] for parameter in parameters))]
+
+class CostContext(context.ImageContext):
+    """ImageContext remembering the seconds of every stage it computed
+
+    A stage shared by several configurations runs once, but its cost is charged to
+    every configuration using it (see run_config).
+    """
+    def __init__(self, image, max_size=None):
+        start = time.perf_counter()
+        super().__init__(image, max_size=max_size)
+        self.base_cost = time.perf_counter() - start
+        self.costs = {}
+        self.used = set()
+
+    def memo(self, key, compute, *args):
+        self.used.add(key)
+        if key not in self.cache:
+            start = time.perf_counter()
+            super().memo(key, compute, *args)
+            self.costs[key] = time.perf_counter() - start
+        return self.cache[key]
+
+def run_config(pipeline, ctx):
+    """(shape, seconds) of one configuration, seconds as if its stages ran alone"""
+    ctx.used = set()
+    computed = sum(ctx.costs.values())
+    start = time.perf_counter()
+    best, _, _ = pipeline.run(ctx)
+    wall = time.perf_counter() - start
+    # the wall time without the stages computed now, plus every stage it used (the
+    # thresholds of a fused pass are charged to the pass)
+    own = wall - (sum(ctx.costs.values()) - computed)
+    return normalize_shape(best.shape), own + ctx.base_cost + sum(ctx.costs.get(key, 0) for key in ctx.used)
+
+def tune_chunk(items, configs, max_size=None):
+    """Worker: every configuration on every image of items, each image decoded once
+
+    Returns (shapes, seconds), both (configurations, images) lists, None for an
+    image that can't be read.
+    """
+    pipelines = [Pipeline(config) for config in configs]
+    shapes = [[] for _ in configs]
+    seconds = [[] for _ in configs]
+    for image_path, _ in items:
+        start = time.perf_counter()
+        image = cv2.imread(image_path)
+        decode = time.perf_counter() - start
+        ctx = CostContext(image, max_size) if image is not None else None
+        for i, pipeline in enumerate(pipelines):
+            shape, cost = run_config(pipeline, ctx) if ctx is not None else (None, 0.0)
+            shapes[i].append(shape)
+            seconds[i].append(decode + cost)
+    return shapes, seconds
+
+def pareto_front(runs):
+    """Runs not beaten in both accuracy and images/s by another run, fastest first"""
+    front = []
+    for run in sorted(runs, key=lambda run: (-run['images_per_s'], -run['accuracy'])):
+        if not front or run['accuracy'] > front[-1]['accuracy']:
+            front.append(run)
+    return front
+
+def tune(items, base='images', sweep=SWEEP, workers=None, max_size=None):
+    """Sweep the configurations of PIPELINES[base] on labeled (image_path, shape) items"""
+    params = sweep_params(PIPELINES[base], sweep)
+    configs = [configure(PIPELINES[base], p) for p in params]
+    workers = workers or os.cpu_count()
+    # a chunk per task, the stages of an image are shared by every configuration
+    size = max(1, len(items) // (4 * workers))
+    chunks = [items[i:i + size] for i in range(0, len(items), size)]
+    worker = partial(tune_chunk, configs=configs, max_size=max_size)
+    if workers == 1:
+        parts = [worker(chunk) for chunk in chunks]
+    else:
+        with Pool(workers) as pool:
+            parts = pool.map(worker, chunks)
+    shapes = np.concatenate([np.array(s, dtype=object) for s, _ in parts], axis=1)
+    seconds = np.concatenate([np.array(t) for _, t in parts], axis=1)
+
+    truths = np.array([shape for _, shape in items], dtype=object)
+    read = shapes[0] != None
+    runs = []
+    for p, config_shapes, config_seconds in zip(params, shapes, seconds):
+        mean = config_seconds[read].mean() if read.any() else 0.0
+        runs.append({
+            'params': p,
+            'accuracy': float(np.mean(config_shapes == truths)),
+            'images_per_s': 1 / mean if mean else 0.0,
+            'ms_per_image': float(mean * 1000),
+        })
+    return runs
+
+def class_labels(ground_truth, labels=None):
+    """{class id: shape}, the most annotated shape of every class of ground_truth
+
+    labels: {class id: shape} given explicitly, they override the annotations
+    """
+    votes = {}
+    for filename, (shape, _) in ground_truth.items():
+        votes.setdefault(class_id(filename), Counter())[shape] += 1
+    classes = {cid: counts.most_common(1)[0][0] for cid, counts in votes.items()}
+    for cid, shape in (labels or {}).items():
+        classes[int(cid)] = normalize_shape(shape)
+    return classes
+
+def labeled_items(input_folder, ground_truth, classes):
+    """(image_path, shape) of the annotated images and of the images of a labeled class"""
+    items = []
+    for path in list_images(input_folder):
+        filename = os.path.basename(path)
+        if filename in ground_truth:
+            items.append((path, ground_truth[filename][0]))
+        elif class_id(filename) in classes:
+            items.append((path, classes[class_id(filename)]))
+    return items
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Sweep the pipeline constants for speed and accuracy')
+    parser.add_argument('--base', choices=PIPELINES, default='images',
+                        help='pipeline whose constants are swept')
+    parser.add_argument('--input', default='traffic_Data', help='folder of the labeled images')
+    parser.add_argument('--ground-truth', default=ANNOTATION_FILE,
+                        help='annotation store of groundTruth.py, or an old ground_truth.json')
+    parser.add_argument('--labels', help='JSON file {class id: shape}, labels whole class folders')
+    parser.add_argument('--sweep', help='JSON file {parameter: [values]} replacing SWEEP')
+    parser.add_argument('--stride', type=int, default=1, help='tune on every n-th labeled image only')
+    parser.add_argument('--limit', type=int, help='maximum number of images')
+    parser.add_argument('--workers', type=int, default=0, help='number of processes, 0 uses every core')
+    parser.add_argument('--max-size', type=int, help='downscale the images to this larger side')
+    parser.add_argument('--output', help='JSON file of every configuration and the Pareto front')
+    return parser.parse_args()
+
+def main():
+    args = parse_args()
+    ground_truth = load_ground_truth(args.ground_truth)
+    labels = None
+    if args.labels:
+        with open(args.labels) as f:
+            labels = json.load(f)
+    items = labeled_items(args.input, ground_truth, class_labels(ground_truth, labels))[::args.stride]
+    if args.limit:
+        items = items[:args.limit]
+    if not items:
+        sys.exit('No labeled image found')
+    sweep = SWEEP
+    if args.sweep:
+        with open(args.sweep) as f:
+            sweep = json.load(f)
+
+    start = time.perf_counter()
+    runs = tune(items, args.base, sweep, args.workers, args.max_size)
+    front = pareto_front(runs)
+    print(f'{len(runs)} configurations on {len(items)} images in {time.perf_counter() - start:.1f} s, '
+          f'Pareto front:', file=sys.stderr)
+    for run in front:
+        print(f"  accuracy {run['accuracy']:.3f}, {run['images_per_s']:.1f} images/s: {run['params']}",
+              file=sys.stderr)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({'base': args.base, 'images': len(items), 'runs': runs, 'pareto': front}, f, indent=4)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,165 @@
+import sys
+import json
+import time
+import argparse
+import cv2
+import numpy as np
+from typing import NamedTuple
+
+import context
+from common import CLASSIFIERS
+from parallel import classify_record
+
+class VideoInfo(NamedTuple):
+    """Frame rate and frame count reported by a source, 0 when it has none (cameras)"""
+    fps: float
+    frames: int
+
+def roi_box(ctr, frame_shape, margin):
+    """Bounding box (x0, y0, x1, y1) of a contour grown by margin of its size on every side"""
+    x, y, w, h = cv2.boundingRect(ctr)
+    dx, dy = int(w * margin), int(h * margin)
+    height, width = frame_shape[:2]
+    return max(0, x - dx), max(0, y - dy), min(width, x + w + dx), min(height, y + h + dy)
+
+def classify_frame(frame, filename, classifier, max_size, roi=None):
+    """Record of one frame, only the roi (x0, y0, x1, y1) is analyzed when it is given"""
+    x0, y0 = 0, 0
+    if roi is not None:
+        x0, y0, x1, y1 = roi
+        frame = frame[y0:y1, x0:x1]
+    record = classify_record(frame, filename, classifier, context.ImageContext(frame, max_size=max_size))
+    if roi is not None and record.ctr is not None:
+        record = record._replace(ctr=record.ctr + np.array([x0, y0], dtype=np.int32))
+    return record
+
+def classifyVideo(source, classifier='images', fps=None, max_size=None, track=True, margin=0.25):
+    """Classify the frames of a video file or camera, yields (frame_index, frame, record, latency, info)
+    
+    frame is a reused buffer, it is only valid until the next frame is read.
+    info: the VideoInfo of the source, read once from its capture
+    
+    fps: frame rate budget. Frames arriving while the previous one is still being
+    processed are grabbed without decoding and dropped. None uses the source rate
+    (0 processes every frame).
+    track: analyze only the region around the last found sign, the whole frame is
+    analyzed again when nothing is found there
+    margin: growth of the tracked region, relative to the size of the sign
+    """
+    capture = cv2.VideoCapture(source)
+    if not capture.isOpened():
+        raise IOError(f"Video Couldn't Open: {source}")
+    info = VideoInfo(capture.get(cv2.CAP_PROP_FPS) or 0, max(int(capture.get(cv2.CAP_PROP_FRAME_COUNT)), 0))
+    if fps is None:
+        fps = info.fps
+    period = 1 / fps if fps else 0
+    frame = None
+    roi = None
+    index = -1
+    start = time.perf_counter()
+    try:
+        while True:
+            # frames due before now are behind the budget, skip them without decoding
+            if period:
+                due = int((time.perf_counter() - start) / period)
+                while index + 1 < due:
+                    if not capture.grab():
+                        return
+                    index += 1
+            # the frame buffer is reused as long as the frame size doesn't change
+            ok, frame = capture.read(frame)
+            if not ok:
+                return
+            index += 1
+            frame_start = time.perf_counter()
+            record = None
+            if track and roi is not None:
+                record = classify_frame(frame, f'frame_{index:06d}', classifier, max_size, roi)
+                if record.ctr is None or record.score == 0:
+                    record = None
+            if record is None:
+                record = classify_frame(frame, f'frame_{index:06d}', classifier, max_size)
+            found = record.ctr is not None and record.score != 0
+            roi = roi_box(record.ctr, frame.shape, margin) if found else None
+            yield index, frame, record, time.perf_counter() - frame_start, info
+    finally:
+        capture.release()
+
+def run(source, classifier='images', fps=None, max_size=None, track=True, annotate=None):
+    """Process a whole video and return the frame rate and latency statistics
+    
+    annotate: optional output video with the found contour drawn on every processed frame
+    """
+    writer = None
+    latencies = []
+    shapes = {}
+    last_index = -1
+    info = VideoInfo(0, 0)
+    start = time.perf_counter()
+    for index, frame, record, latency, info in classifyVideo(source, classifier, fps, max_size, track):
+        latencies.append(latency)
+        shapes[record.shape] = shapes.get(record.shape, 0) + 1
+        last_index = index
+        if annotate is not None:
+            if writer is None:
+                height, width = frame.shape[:2]
+                # only the processed frames are written, at the budget rate or the source one
+                writer = cv2.VideoWriter(annotate, cv2.VideoWriter_fourcc(*'MJPG'), fps or info.fps or 25,
+                                         (width, height))
+            if record.ctr is not None and record.score != 0:
+                # the buffer is overwritten by the next read anyway
+                cv2.drawContours(frame, [record.ctr], -1, (0,255,0), 2)
+            writer.write(frame)
+    elapsed = time.perf_counter() - start
+    # frames dropped after the last processed one are not seen by the loop
+    frames = max(info.frames, last_index + 1)
+    if writer is not None:
+        writer.release()
+    latencies_ms = np.array(latencies) * 1000 if latencies else np.zeros(1)
+    return {
+        'source': str(source),
+        'classifier': classifier,
+        'frames': frames,
+        'processed': len(latencies),
+        'dropped': frames - len(latencies),
+        'fps': len(latencies) / elapsed if elapsed else 0,
+        'latency_ms': {
+            'mean': float(latencies_ms.mean()),
+            'p50': float(np.percentile(latencies_ms, 50)),
+            'p95': float(np.percentile(latencies_ms, 95)),
+            'max': float(latencies_ms.max()),
+        },
+        'shapes': shapes,
+    }
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Shape detection on a video file or camera')
+    parser.add_argument('source', help='video file, or the index of a camera')
+    parser.add_argument('--classifier', choices=CLASSIFIERS, default='images')
+    parser.add_argument('--fps', type=float,
+                        help='frame rate budget, late frames are dropped (default: rate of the '
+                             'source, 0 processes every frame)')
+    parser.add_argument('--max-size', type=int, help='downscale the frames to this larger side')
+    parser.add_argument('--no-track', action='store_true',
+                        help='analyze the whole frame every time, not only around the last sign')
+    parser.add_argument('--annotate', metavar='VIDEO', help='write the processed frames (MJPG .avi)')
+    parser.add_argument('--output', help='JSON file of the statistics, printed if not given')
+    return parser.parse_args()
+
+def main():
+    args = parse_args()
+    source = int(args.source) if args.source.isdigit() else args.source
+    try:
+        report = run(source, args.classifier, args.fps, args.max_size, not args.no_track, args.annotate)
+    except IOError as e:
+        sys.exit(str(e))
+    print(f"{report['processed']}/{report['frames']} frames processed, {report['fps']:.1f} fps, "
+          f"p95 latency {report['latency_ms']['p95']:.2f} ms", file=sys.stderr)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=4)
+    else:
+        print(json.dumps(report, indent=4))
+
+if __name__ == "__main__":
+    main()